@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+'''
+End-to-end benchmark of the backport pipeline, replaying the responses
+recorded in test/cassettes (see bench/replay.py), so it runs offline and
+without a token.
+
+    python bench/bench_backports.py [--copies N] [--repeat N]
+                                    [--save FILE] [--compare FILE]
+
+For each stable branch it lists the backports (get_backports_for_version),
+looks for their originals (guess_original_pr), scores every PR
+(PullRequest.risk) and renders backports.html, timing each stage. It reports
+the time taken, API calls, requests and bytes served and peak RSS. --save
+writes the results to a JSON file and --compare checks them against one,
+exiting non-zero if any of the counts went up (or, with --tolerance, if a
+stage got slower by more than that).
+'''
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import os.path
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from replay import ReplaySession, load_cassettes, synthesize
+
+STATIC = os.path.join(os.path.dirname(__file__), '..', 'static')
+VERSIONS = ['2.8', '2.9', '2.10', '2.11']
+
+# Lower is better for every metric; these are the ones we expect to be
+# exactly the same from run to run, so any change at all is worth a look.
+EXACT = ('api_calls', 'requests', 'bytes')
+
+async def run_pipeline(responses):
+    '''Run every stage once, returning a dict of metric -> value.'''
+    from build import backports_context
+    from releasible.backport import BackportFinder
+    from releasible.model.pullrequest import Backport
+
+    session = ReplaySession(responses)
+    finder = BackportFinder(None, session)
+    timings = {}
+
+    def stage(name):
+        @contextlib.contextmanager
+        def timer():
+            start = time.perf_counter()
+            yield
+            timings[name] = time.perf_counter() - start
+        return timer()
+
+    with stage('search_seconds'):
+        prs = await asyncio.gather(
+            *[finder.get_backports_for_version(v) for v in VERSIONS])
+
+    with stage('originals_seconds'):
+        originals = await asyncio.gather(*[
+            asyncio.gather(
+                *[finder.guess_original_pr(pr, limit=1) for pr in version_prs])
+            for version_prs in prs
+        ])
+
+    backports = {}
+    for version, version_prs, version_originals in zip(VERSIONS, prs, originals):
+        backports[version] = [
+            Backport(pr.pr, pr.files, found[0] if found else None)
+            for pr, found in zip(version_prs, version_originals)
+        ]
+
+    with stage('risk_seconds'):
+        for bps in backports.values():
+            for bp in bps:
+                bp.invalidate_risk()
+                bp.risk
+                if bp.original is not None:
+                    bp.original.invalidate_risk()
+                    bp.original.risk
+        context = backports_context(backports)
+
+    with stage('render_seconds'):
+        render(context)
+
+    timings.update({
+        'backports': sum(len(bps) for bps in backports.values()),
+        'api_calls': finder.calls,
+        'requests': session.requests,
+        'bytes': session.bytes,
+        'missing': len(session.missing),
+    })
+    return timings
+
+def render(context):
+    from jinja2 import Environment, FileSystemLoader
+
+    env = Environment(loader=FileSystemLoader(STATIC))
+    return env.get_template('backports.html').render(
+        active_if=lambda name: '',
+        **context)
+
+def run(responses, repeat):
+    '''The best of ``repeat`` runs of every timing, and the counts.'''
+    best = {}
+    for _ in range(repeat):
+        result = asyncio.run(run_pipeline(responses))
+        for key, value in result.items():
+            if key.endswith('_seconds'):
+                value = min(value, best.get(key, value))
+            best[key] = value
+    best['total_seconds'] = sum(
+        value for key, value in best.items()
+        if key.endswith('_seconds') and key != 'total_seconds')
+    # ru_maxrss is in KiB on Linux.
+    best['peak_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return best
+
+def compare(baseline, result, tolerance):
+    '''Print how ``result`` compares to ``baseline``; return the regressions.'''
+    worse = []
+    print('{0:>18} {1:>14} {2:>14} {3:>8}'.format(
+        'metric', 'baseline', 'now', 'change'))
+    for key in sorted(result):
+        old = baseline.get(key)
+        new = result[key]
+        if old is None:
+            print('{0:>18} {1:>14} {2:>14}'.format(key, '-', fmt(new)))
+            continue
+        change = (new - old) / old if old else 0.0
+        print('{0:>18} {1:>14} {2:>14} {3:>+7.1%}'.format(
+            key, fmt(old), fmt(new), change))
+        if key in EXACT and new > old:
+            worse.append(key)
+        elif key.endswith('_seconds') and tolerance is not None and \
+                change > tolerance:
+            worse.append(key)
+    return worse
+
+def fmt(value):
+    if isinstance(value, float):
+        return '{0:.4f}'.format(value)
+    return str(value)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[1].strip())
+    parser.add_argument(
+        '--copies', type=int, default=20,
+        help='how many times over to replay the recorded PRs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    # Wall times vary too much between machines (and runs) to fail on by
+    # default, so only the counts are checked unless this is given.
+    parser.add_argument(
+        '--tolerance', type=float,
+        help='how much slower a stage may get before --compare fails, '
+             'e.g. 0.25')
+    args = parser.parse_args()
+
+    responses = synthesize(load_cassettes(), args.copies)
+    result = run(responses, args.repeat)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        worse = compare(baseline, result, args.tolerance)
+    else:
+        worse = []
+        for key in sorted(result):
+            print('{0:>18} {1:>14}'.format(key, fmt(result[key])))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    if worse:
+        sys.exit('Worse than the baseline: {0}'.format(', '.join(worse)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+'''
+Micro-benchmark for releasible.references.extract_references against the
+per-line, per-pattern scan guess_original_pr used to do, over the PR titles
+and bodies recorded in the test cassettes (plus some typical backport bodies).
+
+    python bench/bench_references.py [--number N]
+
+Both are checked to find the same references before anything is timed.
+'''
+
+import argparse
+import json
+import os
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from releasible.references import *
+
+CASSETTES = os.path.join(
+    os.path.dirname(__file__), '..', 'test', 'cassettes')
+
+TYPICAL_BODIES = [
+    '##### SUMMARY\n'
+    'Backport of #{0}\n\n'
+    '(cherry picked from commit 0123456789abcdef0123456789abcdef01234567)\n\n'
+    '##### ISSUE TYPE\n- Bugfix Pull Request\n',
+
+    'Fixes #{0}\nFixes #{1}\n\n'
+    'See https://github.com/ansible/ansible/pull/{1} and '
+    'ansible-collections/community.general#{0}\n'
+    'Docs at https://docs.ansible.com/ansible/latest/index.html\n',
+
+    'Original PR: https://github.com/ansible/ansible/commit/'
+    'abcdef0123456789abcdef0123456789abcdef01\n'
+    '* Add a changelog fragment\n' * 3,
+]
+
+def corpus():
+    '''(title, body) pairs to benchmark with.'''
+    import yaml
+
+    out = []
+    for name in sorted(os.listdir(CASSETTES)):
+        with open(os.path.join(CASSETTES, name)) as f:
+            cassette = yaml.safe_load(f)
+        for interaction in cassette['interactions']:
+            body = interaction['response']['body'].get('string')
+            if not isinstance(body, str) or not body.startswith('{'):
+                continue
+            pr = json.loads(body)
+            if 'title' in pr and 'body' in pr:
+                out.append((pr['title'], pr['body'] or ''))
+
+    for n in range(100):
+        for body in TYPICAL_BODIES:
+            out.append((
+                'Fix something (backport of #{0})'.format(70000 + n),
+                body.format(70000 + n, 71000 + n)))
+    return out
+
+def legacy_references(title, body):
+    '''The references the old line-by-line scan found, deduplicated.'''
+    found = []
+
+    title_search = PULL_BACKPORT_IN_TITLE.search(title)
+    if title_search:
+        found.append(TicketRef(int(title_search.group('ticket'))))
+
+    for line in body.split('\n'):
+        cherrypick = PULL_CHERRY_PICKED_FROM.match(line)
+        if cherrypick:
+            found.append(CommitRef(cherrypick.group('hash')))
+            continue
+
+        commit_link = COMMIT_HTTP_URL_RE.search(line)
+        if commit_link:
+            found.append(CommitRef(commit_link.group('hash')))
+            continue
+
+        found.extend(
+            TicketRef(int(ticket))
+            for ticket in TICKET_NUMBER.findall(line))
+        found.extend(
+            PullRef(user, repo, int(ticket))
+            for user, repo, ticket in PULL_HTTP_URL_RE.findall(line))
+        found.extend(
+            PullRef(user, repo, int(ticket))
+            for user, repo, ticket in PULL_URL_RE.findall(line))
+
+    seen = set()
+    out = []
+    for ref in found:
+        if ref.key not in seen:
+            seen.add(ref.key)
+            out.append(ref)
+    return tuple(out)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    prs = corpus()
+    for title, body in prs:
+        expected = legacy_references(title, body)
+        got = extract_references.__wrapped__(title, body)
+        if got != expected:
+            sys.exit('Mismatch for {0!r}:\n  old {1}\n  new {2}'.format(
+                title, expected, got))
+
+    def run(extract):
+        return lambda: [extract(title, body) for title, body in prs]
+
+    results = [
+        ('line-by-line', run(legacy_references)),
+        ('combined pattern', run(extract_references.__wrapped__)),
+        ('combined, memoized', run(extract_references)),
+    ]
+    print('{0} PRs, best of 5 x {1} passes'.format(len(prs), args.number))
+    for name, func in results:
+        best = min(timeit.repeat(func, number=args.number, repeat=5))
+        print('{0:>20}: {1:8.2f} us/PR'.format(
+            name,
+            best / args.number / len(prs) * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+'''
+Serve recorded GitHub responses from the test cassettes through something
+that looks enough like an aiohttp.ClientSession for GitHubAPICall, so that the
+backport pipeline can be run (and timed) offline.
+'''
+
+import copy
+from json import dumps, loads
+import os
+import os.path
+import re
+from urllib.parse import parse_qs, unquote_plus, urlsplit
+
+from multidict import CIMultiDict
+
+CASSETTES = os.path.join(
+    os.path.dirname(__file__), '..', 'test', 'cassettes')
+
+ANSIBLE_PR = re.compile(r'^https://api\.github\.com/repos/ansible/ansible/pulls/\d+$')
+
+def is_ansible_pr(url):
+    return ANSIBLE_PR.match(url) is not None
+
+def normalize(url):
+    '''Cassettes record URLs percent-encoded, we request them raw.'''
+    return unquote_plus(url)
+
+class ReplayContent:
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+class ReplayResponse:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.content = ReplayContent(body)
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        return self.body.decode('utf-8')
+
+    def get_encoding(self):
+        return 'utf-8'
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+class ReplaySession:
+    '''
+    Answers requests from ``responses`` (URL -> (status, headers, body)),
+    following redirects like aiohttp does. The issue search for backports is
+    made up from the recorded PRs against the branches asked for (open or
+    not), and commit searches we have no recording of find nothing. Anything
+    else is a 404.
+
+    Counts requests and bytes served, and the URLs it had nothing for.
+    '''
+    def __init__(self, responses):
+        self.responses = responses
+        # (base branch, number, updated_at) of every recorded PR, for the
+        # made up issue search.
+        self.prs = [
+            (pr['base']['ref'], pr['number'], pr['updated_at'])
+            for pr in map(loads, (
+                body for url, (status, headers, body) in responses.items()
+                if status == 200 and is_ansible_pr(url)))
+        ]
+        self.requests = 0
+        self.bytes = 0
+        self.missing = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        return self._respond(normalize(url))
+
+    def get(self, url, headers=None, **kwargs):
+        return self.request('GET', url, headers, **kwargs)
+
+    def _respond(self, url):
+        self.requests += 1
+        if url.startswith('https://api.github.com/search/issues'):
+            status, headers, body = self._search_issues(url)
+        elif url in self.responses:
+            status, headers, body = self.responses[url]
+        elif url.startswith('https://api.github.com/search/commits'):
+            status, headers, body = 200, {}, b'{"total_count": 0, "items": []}'
+        else:
+            self.missing.append(url)
+            status, headers, body = 404, {}, b'{"message": "Not Found"}'
+
+        if status in (301, 302, 307, 308) and 'location' in headers:
+            return self._respond(normalize(headers['location']))
+
+        self.bytes += len(body)
+        return ReplayResponse(status, CIMultiDict(headers), body)
+
+    def _search_issues(self, url):
+        query = parse_qs(urlsplit(url).query)['q'][0]
+        base = [
+            term.split(':', 1)[1]
+            for term in query.split()
+            if term.startswith('base:')
+        ]
+
+        items = [
+            {'number': number, 'updated_at': updated_at}
+            for ref, number, updated_at in sorted(self.prs, reverse=True)
+            if ref in base
+        ]
+
+        body = dumps({'total_count': len(items), 'items': items})
+        return 200, {}, body.encode('utf-8')
+
+def load_cassettes(path=CASSETTES):
+    '''Every recorded response, as URL -> (status, headers, body).'''
+    import yaml
+
+    responses = {}
+    for name in sorted(os.listdir(path)):
+        if not name.endswith('.yaml'):
+            continue
+        with open(os.path.join(path, name)) as f:
+            cassette = yaml.safe_load(f)
+        for interaction in cassette['interactions']:
+            response = interaction['response']
+            headers = {
+                key.lower(): value[0]
+                for key, value in response['headers'].items()
+            }
+            # The body was decoded when it was recorded.
+            headers.pop('content-encoding', None)
+            body = response['body'].get('string', '')
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            responses[normalize(interaction['request']['uri'])] = (
+                response['status']['code'],
+                headers,
+                body)
+    return responses
+
+def synthesize(responses, copies):
+    '''
+    Make the recorded ansible/ansible PRs ``copies`` times over, with
+    new numbers, so that there is more to chew on than what we recorded. The
+    copies keep their title and body, so they point at the same originals.
+    '''
+    out = dict(responses)
+    prs = [
+        (url, entry)
+        for url, entry in responses.items()
+        if entry[0] == 200 and is_ansible_pr(url)
+    ]
+    for copy_number in range(1, copies):
+        for url, (status, headers, body) in prs:
+            pr = loads(body)
+            diff = responses.get(normalize(pr['diff_url']))
+            if diff is None:
+                continue
+
+            pr = copy.deepcopy(pr)
+            pr['number'] += copy_number * 100000
+            pr['url'] = '{0}/{1}'.format(url.rsplit('/', 1)[0], pr['number'])
+            pr['html_url'] = 'https://github.com/ansible/ansible/pull/{0}'.format(
+                pr['number'])
+            pr['diff_url'] = pr['html_url'] + '.diff'
+            out[pr['url']] = (status, headers, dumps(pr).encode('utf-8'))
+            out[pr['diff_url']] = diff
+    return out
@@ -1,65 +1,269 @@
 #!/usr/bin/env python3
 
 import aiohttp
+import argparse
 import asyncio
+import contextlib
+import json
+import logging
 import os
 import os.path
+import signal
 from staticjinja import Site
+import subprocess
 import sys
 
-from releasible.github import GitHubAPICall
 from releasible.backport import BackportFinder
+from releasible.cache import open_cache
+from releasible.commitindex import CommitIndex
+from releasible.contextcache import ContextCache
+from releasible.github import RequestScheduler, TokenPool
 from releasible.model.pullrequest import Backport
+from releasible.pypi import PyPIClient
+from releasible import snapshot
+from releasible.store import BackportStore
+from releasible.trace import Tracer
 
 GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN_RO')
+
+# A file of more tokens to spread GitHub requests over, one per line, on top
+# of GITHUB_TOKEN_RO (which can also be several, comma-separated). Each has
+# its own rate limits.
+GITHUB_TOKENS_FILE = os.environ.get('RELEASIBLE_GITHUB_TOKENS_FILE')
+
+# Another server to send GitHub requests to instead, e.g. test/fakegithub.py
+# for load testing. Give it its own RELEASIBLE_CACHE and RELEASIBLE_STORE.
+GITHUB_SERVER = os.environ.get('RELEASIBLE_GITHUB_SERVER') or None
 VERSIONS = ['2.8', '2.9', '2.10', '2.11']
 
-async def ctx_aut(template):
-    aio_session = aiohttp.ClientSession()
-    client = GitHubAPICall(GITHUB_TOKEN, aio_session)
+# Which PyPI package each version of core is released as.
+CORE_PACKAGES = {
+    '2.8': 'ansible',
+    '2.9': 'ansible',
+    '2.10': 'ansible-base',
+    '2.11': 'ansible-core',
+}
+
+# What core needs from PyPI, shown on the dependencies page.
+DEPENDENCIES = [
+    'cryptography',
+    'jinja2',
+    'markupsafe',
+    'packaging',
+    'paramiko',
+    'pyyaml',
+    'resolvelib',
+]
+
+# Where to keep GitHub responses between builds so that we can revalidate them
+# with conditional requests. Set to an empty string to disable.
+CACHE_PATH = os.environ.get('RELEASIBLE_CACHE', '.cache/github.sqlite')
+
+# Where to keep fetched backports and their originals between builds, so that
+# only PRs updated since the last build are looked at again. Set to an empty
+# string to disable.
+STORE_PATH = os.environ.get('RELEASIBLE_STORE', '.cache/backports.sqlite')
+
+# Local clones to look up which PR a commit came from in, before falling back
+# to GitHub's commit search, as comma-separated repo=path pairs, e.g.
+# "ansible/ansible=/srv/git/ansible.git". They are fetched at the start of each
+# build. Clone them with `git clone --mirror` to get refs/pull/* as well.
+GIT_MIRRORS = dict(
+    mirror.split('=', 1)
+    for mirror in os.environ.get('RELEASIBLE_GIT_MIRRORS', '').split(',')
+    if mirror)
+
+# Where to keep the index built from GIT_MIRRORS.
+COMMIT_INDEX_PATH = os.environ.get(
+    'RELEASIBLE_COMMIT_INDEX',
+    '.cache/commits.sqlite')
+
+# The commit index, brought up to date once per run (see open_commit_index())
+# before anything is fetched, and shared by every fetch after that.
+COMMIT_INDEX = None
+
+# How many requests to have in flight to GitHub at once, per token.
+MAX_CONCURRENCY = int(os.environ.get('RELEASIBLE_CONCURRENCY', 10))
+
+# How many backports to list per GraphQL query. Set to 0 to list them over
+# REST instead (two requests per PR).
+GRAPHQL_BATCH_SIZE = int(os.environ.get('RELEASIBLE_GRAPHQL_BATCH', 50))
+
+# Whether to find out which of each backport's "#nnnn" references are PRs with
+# one GraphQL query, instead of asking for each as a PR and getting a 404 for
+# the issues.
+CLASSIFY_REFERENCES = os.environ.get('RELEASIBLE_CLASSIFY_REFS', '1') == '1'
+
+# How many days to remember that a reference isn't a PR for.
+NOT_PR_TTL_DAYS = float(os.environ.get('RELEASIBLE_NOT_PR_TTL_DAYS', 30))
+
+# Where `build.py fetch` writes every page's context, for `build.py render` to
+# build the site from without fetching anything.
+SNAPSHOT_PATH = os.environ.get(
+    'RELEASIBLE_SNAPSHOT',
+    '.cache/snapshot.json.gz')
+
+# In reloader mode, how many seconds to keep showing a page's data for before
+# fetching it again. `kill -USR1` the build to fetch everything now.
+CONTEXT_TTL = float(os.environ.get('RELEASIBLE_CONTEXT_TTL', 15 * 60))
+
+# The parts of an Actions job that aut.html shows.
+JOB_KEYS = (
+    'name',
+    'html_url',
+    'status',
+    'conclusion',
+    'started_at',
+    'completed_at',
+)
+
+def github_token():
+    '''
+    The token for GitHubAPICall: the one token we have, or a TokenPool if we
+    have several.
+    '''
+    tokens = [t.strip() for t in (GITHUB_TOKEN or '').split(',') if t.strip()]
+    if GITHUB_TOKENS_FILE:
+        with open(GITHUB_TOKENS_FILE) as f:
+            tokens.extend(
+                line.strip() for line in f
+                if line.strip() and not line.startswith('#'))
+    if len(set(tokens)) > 1:
+        return TokenPool(tokens)
+    return tokens[0] if tokens else None
+
+def github_concurrency(token):
+    '''How many requests to have in flight at once, MAX_CONCURRENCY a token.'''
+    if isinstance(token, TokenPool):
+        return MAX_CONCURRENCY * len(token.tokens)
+    return MAX_CONCURRENCY
+
+def open_commit_index():
+    '''
+    Bring the commit index up to date with GIT_MIRRORS, if there are any. A
+    mirror which can't be fetched or read keeps whatever was indexed from it
+    before; commits it doesn't know fall back to GitHub's commit search.
+    '''
+    if not GIT_MIRRORS:
+        return None
+    index = CommitIndex(COMMIT_INDEX_PATH)
+    for repo, path in GIT_MIRRORS.items():
+        try:
+            count = index.update(repo, path, fetch=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(
+                'Could not update the commit index from {0}: {1}'.format(
+                    repo,
+                    e),
+                file=sys.stderr)
+            continue
+        print('Indexed {0} new commits from {1}'.format(count, repo))
+    return index
+
+class Clients:
+    '''
+    The HTTP session and API clients shared by every page of a build, so that
+    connections, caches and rate limit tracking carry over between pages.
+    '''
+    def __init__(self, aio_session, tracer=None, token=None):
+        self.aio_session = aio_session
+        self.tracer = tracer
+        self.cache = open_cache(CACHE_PATH)
+        self.scheduler = RequestScheduler(github_concurrency(token))
+        self.github = BackportFinder(
+            token,
+            aio_session,
+            self.cache,
+            self.scheduler,
+            tracer=tracer,
+            server=GITHUB_SERVER,
+            graphql_batch_size=GRAPHQL_BATCH_SIZE,
+            store=BackportStore(STORE_PATH) if STORE_PATH else None,
+            commit_index=COMMIT_INDEX,
+            classify_references=CLASSIFY_REFERENCES,
+            not_pr_ttl=NOT_PR_TTL_DAYS * 24 * 60 * 60)
+        self.pypi = PyPIClient(aio_session, self.cache, tracer=tracer)
+
+    def close(self):
+        '''
+        Close the databases opened for this fetch. The commit index outlives
+        it, being shared by every fetch.
+        '''
+        if self.cache is not None:
+            self.cache.close()
+        if self.github.store is not None:
+            self.github.store.close()
+
+    def report(self):
+        gh = self.github
+        print(
+            '{0} API calls: {1} cache hits, {2} misses, {3} '
+            'revalidations'.format(
+                gh.calls,
+                gh.cache_hits,
+                gh.cache_misses,
+                gh.cache_revalidations))
+        print(
+            '{0:.1f} requests/s, {1} retries, {2:.1f}s waiting on rate '
+            'limits'.format(
+                self.scheduler.throughput(),
+                self.scheduler.retries,
+                self.scheduler.waited))
+
+async def ctx_aut(clients):
+    client = clients.github
     latest_run = await client.get('https://api.github.com/repos/relrod/aut/actions/runs?per_page=1')
-    jobs_url = '{}?per_page=100'.format(latest_run['workflow_runs'][0]['jobs_url'])
-    jobs_req = await client.get(jobs_url)
-    jobs = jobs_req['jobs']
+    jobs = await client.get_all_pages(
+        '{}?per_page=100'.format(latest_run['workflow_runs'][0]['jobs_url']),
+        key='jobs')
+    return {'jobs': [{key: job.get(key) for key in JOB_KEYS} for job in jobs]}
+
+async def backports_for_version(bf, version):
+    # Start looking for each backport's original as soon as we have it,
+    # while the rest are still being fetched.
+    prs = []
+    lookups = []
+    async for pr in bf.iter_backports_for_version(version):
+        prs.append(pr)
+        lookups.append(
+            asyncio.ensure_future(bf.guess_original_pr(pr, limit=1)))
+    originals = await asyncio.gather(*lookups)
+
+    # We need to bail out/error if this is never true, because otherwise
+    # we'd show PRs that belong to originals that don't make sense.
+    assert len(prs) == len(originals)
+
+    backports = []
+    for idx, pr in enumerate(prs):
+        original = originals[idx]
+        if original:
+            original = original[0]
+        else:
+            original = None
+        backports.append(Backport(pr.pr, pr.files, original))
 
-    next_page = client.next_page_url()
-    while next_page:
-        next_resp = await client.get(next_page)
-        jobs += next_resp['jobs']
-        next_page = client.next_page_url()
+    return backports
 
-    await aio_session.close()
-    return {'jobs': jobs}
+async def ctx_backports(clients):
+    bf = clients.github
 
-async def ctx_backports(template):
-    backports = {}
-    aio_session = aiohttp.ClientSession()
-    bf = BackportFinder(GITHUB_TOKEN, aio_session)
+    # Branches don't depend on each other, so collect them all at once. They
+    # share one finder, so originals common to several branches are only
+    # fetched once.
+    cors = [backports_for_version(bf, version) for version in VERSIONS]
+    return backports_context(
+        dict(zip(VERSIONS, await asyncio.gather(*cors))))
 
+def backports_context(backports):
+    '''
+    The context for backports.html, given a dict of version -> list of
+    Backports.
+    '''
+    # Risk is relative to the riskiest PR across every branch.
     max_risk = 0
     max_orig_risk = 0
-
-    for version in VERSIONS:
-        prs = await bf.get_backports_for_version(version)
-        backports[version] = []
-
-        cors = [bf.guess_original_pr(pr) for pr in prs]
-        originals = await asyncio.gather(*cors)
-
-        # We need to bail out/error if this is never true, because otherwise
-        # we'd show PRs that belong to originals that don't make sense.
-        assert len(prs) == len(originals)
-
-        for idx, pr in enumerate(prs):
-            original = originals[idx]
-            if original:
-                original = original[0]
-            else:
-                original = None
-            bp = Backport(pr.pr, pr.diff, original)
-            backports[version].append(bp)
-
-            # While we're here track global max risks
+    for bps in backports.values():
+        for bp in bps:
             if bp.risk > max_risk:
                 max_risk = bp.risk
 
@@ -73,11 +277,130 @@ async def ctx_backports(template):
         'max_orig_risk': max_orig_risk,
     }
 
-    await aio_session.close()
     return out
 
-def ctx_overview(template):
-    return {'f': 3}
+def with_next_release(release):
+    try:
+        return release, release.guess_next_release()
+    except Exception:
+        # We don't guess what comes after a beta.
+        return release, None
+
+async def core_releases(clients):
+    '''
+    The latest release of each version of core and a guess at its next one,
+    as (release, next release or None) pairs.
+    '''
+    # Several versions share a package, but each package is only fetched and
+    # parsed once.
+    packages = await clients.pypi.packages(sorted(set(CORE_PACKAGES.values())))
+
+    releases = []
+    for version in VERSIONS:
+        release = packages[CORE_PACKAGES[version]].latest(version)
+        if release is not None:
+            releases.append(with_next_release(release))
+    return releases
+
+async def ctx_overview(clients):
+    return {'releases': await core_releases(clients)}
+
+async def ctx_packages(clients):
+    return {'releases': await core_releases(clients)}
+
+async def ctx_dependencies(clients):
+    packages = await clients.pypi.packages(DEPENDENCIES)
+
+    dependencies = []
+    for pkg, pypi in packages.items():
+        latest = pypi.newest()
+        prerelease = pypi.newest(prereleases=True)
+        if latest is not None and prerelease == latest:
+            prerelease = None
+        dependencies.append({
+            'name': pkg,
+            'latest': latest,
+            'prerelease': prerelease,
+            'yanked': pypi.yanked,
+        })
+    return {'dependencies': dependencies}
+
+async def fetch_contexts(tracer=None, pages=None):
+    '''
+    Fetch the context of every page with a ctx_ function (or just of
+    ``pages``), all at once and over one pooled HTTP session. Returns a dict
+    of page name to context. If given a Tracer, each page's fetch is
+    recorded as a span in it.
+    '''
+    names = [
+        name for name in globals()
+        if name.startswith('ctx_') and
+        (pages is None or name[len('ctx_'):] in pages)
+    ]
+    if not names:
+        return {}
+
+    token = github_token()
+    connector = aiohttp.TCPConnector(
+        limit_per_host=github_concurrency(token),
+        keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as aio_session:
+        with contextlib.closing(Clients(aio_session, tracer, token)) as clients:
+
+            async def fetch(func):
+                with span(tracer, func.__name__, 'context'):
+                    if asyncio.iscoroutinefunction(func):
+                        return await func(clients)
+                    return func(clients)
+
+            contexts = await asyncio.gather(
+                *[fetch(globals()[name]) for name in names])
+            clients.report()
+
+    return {
+        name[len('ctx_'):]: context
+        for name, context in zip(names, contexts)
+    }
+
+def span(tracer, name, category):
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, category)
+
+def traced_render(tracer):
+    '''A staticjinja rule rendering pages as usual, each in a span.'''
+    def render(site, template, **context):
+        with tracer.span(template.name, 'render'):
+            filepath = os.path.join(site.outpath, template.name)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            template.stream(**context).dump(filepath, site.encoding)
+    return render
+
+def refresh_on_signal(site):
+    '''
+    Fetch every page's context again and re-render the site on SIGUSR1, for
+    reloader mode: `kill -USR1 <pid>`.
+    '''
+    def refresh(signum, frame):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            print('Refreshing data...')
+            CONTEXTS.refresh()
+            site.render_templates(site.templates)
+        else:
+            # We're in the middle of fetching something; leave the rest to
+            # the next render.
+            CONTEXTS.expire()
+
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, refresh)
+
+# Page name -> context, filled in by fetch_contexts() before rendering. In
+# reloader mode, a page's context is fetched again when it's rendered after
+# CONTEXT_TTL seconds; otherwise re-rendering reuses what we have.
+CONTEXTS = ContextCache(
+    lambda pages: asyncio.run(fetch_contexts(pages=pages)))
 
 def base(template):
     out = {}
@@ -89,28 +412,77 @@ def base(template):
 
     out['active_if'] = active_if
 
-    func = globals().get('ctx_' + tpl_name)
-    if func:
-        if asyncio.iscoroutinefunction(func):
-            res = asyncio.run(func(template))
-        else:
-            res = func(template)
-        for k, v in res.items():
-            out[k] = v
+    for k, v in CONTEXTS.get(tpl_name, {}).items():
+        out[k] = v
 
     return out
 
 if __name__ == "__main__":
-    if not GITHUB_TOKEN:
-        print('Define $GITHUB_TOKEN_RO first (hint: use a "personal token")')
-        sys.exit(1)
-
-    site = Site.make_site(
-        searchpath='static',
-        outpath='site',
-        contexts=[(r'.*\.html', base)],
-    )
-    if len(sys.argv) > 1 and sys.argv[1] == 'build':
-        site.render(use_reloader=False)
-    else:
-        site.render(use_reloader=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'mode',
+        nargs='?',
+        choices=['fetch', 'render', 'build'],
+        help='"fetch" to fetch everything into a snapshot, "render" to build '
+             'the site from the snapshot, "build" to do both; otherwise '
+             'fetch and re-render on changes')
+    parser.add_argument(
+        '--snapshot',
+        metavar='FILE',
+        default=SNAPSHOT_PATH,
+        help='where fetch writes and render reads every page\'s context '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help='write a Chrome trace of every request and page to FILE, and '
+             'print a summary of the requests made')
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='log every request')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(message)s',
+        level=logging.INFO if args.verbose else logging.WARNING)
+
+    tracer = Tracer() if args.trace else None
+    try:
+        if args.mode == 'render':
+            with span(tracer, 'load snapshot', 'snapshot'):
+                CONTEXTS.update(snapshot.load(args.snapshot))
+            # Render only what's in the snapshot, never fetching.
+            CONTEXTS.fetch = lambda pages: {}
+        else:
+            if not GITHUB_TOKEN and not GITHUB_TOKENS_FILE and \
+                    not GITHUB_SERVER:
+                print('Define $GITHUB_TOKEN_RO first (hint: use a "personal '
+                      'token")')
+                sys.exit(1)
+            # Git is slow and blocking, so do it once, before the event
+            # loop starts.
+            with span(tracer, 'update commit index', 'git'):
+                COMMIT_INDEX = open_commit_index()
+            CONTEXTS.update(asyncio.run(fetch_contexts(tracer)))
+            with span(tracer, 'write snapshot', 'snapshot'):
+                snapshot.dump(CONTEXTS.contexts, args.snapshot)
+
+        if args.mode != 'fetch':
+            site = Site.make_site(
+                searchpath='static',
+                outpath='site',
+                contexts=[(r'.*\.html', base)],
+                rules=[(r'.*\.html', traced_render(tracer))] if tracer else None,
+            )
+            if args.mode is None:
+                CONTEXTS.ttl = CONTEXT_TTL
+                CONTEXTS.fetch = lambda pages: asyncio.run(
+                    fetch_contexts(tracer, pages))
+                refresh_on_signal(site)
+            site.render(use_reloader=args.mode is None)
+    finally:
+        if tracer is not None:
+            print(tracer.format_summary())
+            with open(args.trace, 'w') as f:
+                json.dump(tracer.chrome_trace(), f)
@@ -1,15 +1,33 @@
 import asyncio
+import functools
+import json
+import logging
 import re
-from releasible.github import GitHubAPICall
-from releasible.model.pullrequest import Backport, PullRequest
+from releasible.diffstat import count_diff
+from releasible.github import GitHubAPICall, GitHubAPIError
+from releasible.graphql import SEARCH_PULL_REQUESTS, pr_from_graphql
+from releasible.model.pullrequest import Backport, FileStat, PullRequest
+from releasible.references import (
+    COMMIT_HTTP_URL_RE,
+    PULL_BACKPORT_IN_TITLE,
+    PULL_CHERRY_PICKED_FROM,
+    PULL_HTTP_URL_RE,
+    PULL_URL_RE,
+    TICKET_NUMBER,
+    CommitRef,
+    PullRef,
+    TicketRef,
+    extract_references,
+)
+from releasible.trace import in_phase, phase
 from unidiff import PatchSet
 
-PULL_URL_RE = re.compile(r'(?P<user>\S+)/(?P<repo>\S+)#(?P<ticket>\d+)')
-PULL_HTTP_URL_RE = re.compile(r'https?://(?:www\.|)github\.com/(?P<user>\S+)/(?P<repo>\S+)/pull/(?P<ticket>\d+)')
-COMMIT_HTTP_URL_RE = re.compile(r'https?://(?:www\.|)github\.com/(?P<user>\S+)/(?P<repo>\S+)/commit/(?P<hash>\w+)')
-PULL_BACKPORT_IN_TITLE = re.compile(r'\((?:backport of |)#?(?P<ticket>\d+)\)', re.I)
-PULL_CHERRY_PICKED_FROM = re.compile(r'\(?cherry(?:\-| )picked from(?: commit|) (?P<hash>\w+)(?:\)|\.|$)')
-TICKET_NUMBER = re.compile(r'(?:^|\s)#(?P<ticket>\d+)')
+log = logging.getLogger(__name__)
+
+API_PULL_URL_RE = re.compile(r'^https://api\.github\.com/repos/(?P<user>[^/]+)/(?P<repo>[^/]+)/pulls/(?P<ticket>\d+)$')
+
+class NotAPullRequest(Exception):
+    '''Raised by get_pr for a reference we already know isn't to a PR.'''
 
 def normalize_pr_url(
         pr,
@@ -17,10 +35,11 @@ def normalize_pr_url(
         only_number=False,
         api=False):
     '''
-    Given a JSON response (dict), or a string containing a PR number, PR URL,
-    or internal PR URL (e.g. ansible-collections/community.general#1234),
-    return either a full github URL to the PR (if only_number is False),
-    or an int containing the PR number (if only_number is True).
+    Given a JSON response (dict), a PullRef or TicketRef, or a string
+    containing a PR number, PR URL, or internal PR URL (e.g.
+    ansible-collections/community.general#1234), return either a full github
+    URL to the PR (if only_number is False), or an int containing the PR
+    number (if only_number is True).
 
     Throws if it can't parse the input.
 
@@ -42,6 +61,14 @@ def normalize_pr_url(
                 repo,
                 ticket)
 
+    if isinstance(pr, TicketRef):
+        pr = PullRef('ansible', 'ansible', pr.number)
+
+    if isinstance(pr, PullRef):
+        if only_number:
+            return pr.number
+        return url(pr.user, pr.repo, pr.number)
+
     if isinstance(pr, dict):
         url = pr.get('url') if api else pr.get('html_url')
         if url is None:
@@ -79,14 +106,166 @@ def normalize_pr_url(
 
     raise Exception('Did not understand given PR')
 
+# What every commit search is narrowed down to, besides the commits' hashes.
+COMMIT_SEARCH_SCOPE = 'org:ansible org:ansible-collections is:public'
+
+# GitHub doesn't search for queries longer than this.
+MAX_SEARCH_QUERY_LENGTH = 256
+
+def commit_search_url(shas):
+    '''
+    The commit search for any of ``shas``.
+
+    >>> commit_search_url(['abc'])
+    'https://api.github.com/search/commits?per_page=100&q=hash:abc org:ansible org:ansible-collections is:public'
+    '''
+    query = ' '.join(['hash:{0}'.format(sha) for sha in shas] +
+                     [COMMIT_SEARCH_SCOPE])
+    return 'https://api.github.com/search/commits?per_page=100&q={0}'.format(
+        query)
+
+def commit_search_batches(shas, max_length=MAX_SEARCH_QUERY_LENGTH):
+    '''
+    Split ``shas`` into as few groups as can each be searched for at once
+    without the query getting too long.
+
+    >>> [len(batch) for batch in commit_search_batches(['a' * 40] * 9)]
+    [4, 4, 1]
+    '''
+    batches = []
+    length = len(COMMIT_SEARCH_SCOPE)
+    for sha in shas:
+        term = len('hash:') + len(sha) + 1
+        if batches and length + term <= max_length:
+            batches[-1].append(sha)
+            length += term
+        else:
+            batches.append([sha])
+            length = len(COMMIT_SEARCH_SCOPE) + term
+    return batches
+
+class CommitSearchBatcher:
+    '''
+    Collects the commit searches asked for within ``window`` seconds of the
+    first one, and makes them as a few searches for several hashes each
+    (commit_search_batches()) rather than one search per commit. The search
+    API only allows 30 requests a minute, so this is usually what a build
+    ends up waiting on.
+
+    A lone commit is searched for exactly as it would be on its own.
+    '''
+    def __init__(self, api, window=0.05):
+        self.api = api
+        self.window = window
+        # sha -> future of its search results
+        self.pending = {}
+        self.flushing = None
+        self.searches = 0
+
+    async def search(self, sha):
+        '''The commit search results for ``sha``.'''
+        future = self.pending.get(sha)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[sha] = future
+            if self.flushing is None:
+                self.flushing = asyncio.ensure_future(self.flush())
+        # Shielded, so that one waiter giving up doesn't fail the others.
+        return await asyncio.shield(future)
+
+    async def flush(self):
+        await asyncio.sleep(self.window)
+        pending, self.pending, self.flushing = self.pending, {}, None
+        await asyncio.gather(*[
+            self._search(batch, pending)
+            for batch in commit_search_batches(list(pending))
+        ])
+
+    async def _search(self, batch, futures):
+        self.searches += 1
+        try:
+            items = (await self.api.get(commit_search_url(batch))).get(
+                'items') or []
+        except Exception as e:
+            for sha in batch:
+                futures[sha].set_exception(e)
+                # Waiters may have been cancelled; don't complain about
+                # nobody looking at the exception.
+                futures[sha].exception()
+            return
+
+        for sha in batch:
+            if len(batch) == 1:
+                found = items
+            else:
+                found = [
+                    item for item in items
+                    if item.get('sha', '').lower().startswith(sha.lower())
+                ]
+            futures[sha].set_result(found)
+
 class BackportFinder(GitHubAPICall):
+    def __init__(self, *args, graphql_batch_size=None, file_stats_from='diff',
+                 store=None, commit_index=None, classify_references=False,
+                 not_pr_ttl=30 * 24 * 60 * 60, commit_search_window=0.05,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        # Most "#nnnn" in PR bodies are issues, which 404 when asked for as
+        # PRs. Remember which references aren't PRs (for ``not_pr_ttl``
+        # seconds, if there's a store) so that we stop asking.
+        self.not_prs = set()
+        self.not_pr_ttl = not_pr_ttl
+
+        # If set, guess_original_pr finds out which of a backport's
+        # references are PRs with one GraphQL query before looking any up.
+        self.classify_references = classify_references
+
+        # A CommitIndex built from local clones, checked before asking
+        # GitHub's (heavily rate limited) commit search which PR a commit
+        # came from.
+        self.commit_index = commit_index
+
+        # If set, commit searches asked for within this many seconds of each
+        # other are combined into as few searches as possible.
+        self.commit_searches = None
+        if commit_search_window:
+            self.commit_searches = CommitSearchBatcher(
+                self,
+                commit_search_window)
+
+        # A BackportStore, so that PRs which haven't been updated since the
+        # last build (and their originals) aren't fetched again.
+        self.store = store
+
+        # Where get_pr gets per-file line counts from: 'diff' counts them in
+        # the PR's .diff, 'api' asks the /pulls/{n}/files endpoint.
+        self.file_stats_from = file_stats_from
+
+        # If set, backports are listed with GraphQL, fetching this many PRs
+        # (and their file stats) per query instead of two REST calls per PR.
+        self.graphql_batch_size = graphql_batch_size
+
+        # The same original PR tends to turn up many times in a build (title,
+        # body, commit lookups, several stable branches). Keep the task that
+        # fetches each PR, keyed on its API URL, so that concurrent callers
+        # share one download and later callers get the finished PullRequest.
+        self.prs = {}
+
+    @in_phase('commit search')
     async def prs_for_commit(self, sha):
+        if self.commit_index is not None:
+            found = self.commit_index.lookup(sha)
+            if found:
+                return await asyncio.gather(*[
+                    self.get_pr('{0}#{1}'.format(repo, number))
+                    for repo, number in found
+                ])
+
         # Find the repos associated with the commit
-        query = 'hash:{0} org:ansible org:ansible-collections is:public'.format(
-            sha)
-        url = 'https://api.github.com/search/commits?per_page=100&q={0}'.format(
-            query)
-        res = (await self.get(url)).get('items')
+        if self.commit_searches is not None:
+            res = await self.commit_searches.search(sha)
+        else:
+            res = (await self.get(commit_search_url([sha]))).get('items')
 
         if not res:
             return []
@@ -102,9 +281,12 @@ class BackportFinder(GitHubAPICall):
                 sha)
             try:
                 prs += await self.get(url)
-            except Exception as e:
-                print(e)
-                pass
+            except GitHubAPIError as e:
+                # Anything but the commit not being there is worth another
+                # try later (see _lookup).
+                if e.status != 404:
+                    raise
+                log.warning('%s', e)
 
         # We have to query the actual pull request endpoint, otherwise we lack
         # the fields we use later for scoring (comments, review_comments, etc.)
@@ -114,30 +296,271 @@ class BackportFinder(GitHubAPICall):
             *[self.get_pr(pr['html_url']) for pr in prs])
 
     async def get_backports_for_version(self, version):
-        out = []
+        return [pr async for pr in self.iter_backports_for_version(version)]
+
+    async def iter_backports_for_version(self, version, window=100):
+        '''
+        Yield the open backports for a version as PullRequests, in search
+        order. Each PR is fetched as soon as the search page listing it
+        arrives, rather than after the last page, with up to ``window`` of
+        them in flight ahead of whoever is consuming this.
+        '''
         query = 'is:pr is:open repo:ansible/ansible label:backport '
         query += '-label:waiting_on_upstream -label:on_hold '
         query += 'base:stable-{0}'.format(version)
 
-        prs = await self.get_all_pages(
-            'https://api.github.com/search/issues?per_page=100&'
-            'sort=created&q={0}'.format(query),
-            key='items')
+        if self.graphql_batch_size:
+            async for pr in self.iter_prs_graphql(query + ' sort:created-desc'):
+                yield pr
+            return
+
+        # Search in the background, queueing a fetch for each PR found. Only
+        # ``window`` fetches are queued at once, so the search stalls rather
+        # than running away when we're slow to consume.
+        queue = asyncio.Queue()
+        slots = asyncio.Semaphore(window)
 
-        cors = [self.get_pr(pr['number']) for pr in prs]
-        return await asyncio.gather(*cors)
+        @in_phase('search')
+        async def search():
+            try:
+                async for pr in self.iter_pages(
+                        'https://api.github.com/search/issues?per_page=100&'
+                        'sort=created&q={0}'.format(query),
+                        key='items'):
+                    await slots.acquire()
+                    queue.put_nowait(asyncio.ensure_future(
+                        self.get_pr(pr['number'], updated_at=pr['updated_at'])))
+            except Exception as e:
+                queue.put_nowait(e)
+            else:
+                queue.put_nowait(None)
 
+        searching = asyncio.ensure_future(search())
+        try:
+            while True:
+                fetch = await queue.get()
+                slots.release()
+                if fetch is None:
+                    break
+                if isinstance(fetch, Exception):
+                    raise fetch
+                yield await fetch
+        finally:
+            searching.cancel()
+            while not queue.empty():
+                fetch = queue.get_nowait()
+                if isinstance(fetch, asyncio.Future):
+                    fetch.cancel()
 
-    async def get_pr(self, pr, allow_non_ansible_ansible=True) -> PullRequest:
-        pr_dict = await self.get(
-            normalize_pr_url(
-                pr,
-                allow_non_ansible_ansible=allow_non_ansible_ansible,
-                api=True))
-        pr_diff = PatchSet(await self.get(pr_dict['diff_url'], json=False))
-        return PullRequest(pr_dict, pr_diff)
+    async def get_prs_graphql(self, query):
+        return [pr async for pr in self.iter_prs_graphql(query)]
+
+    async def iter_prs_graphql(self, query):
+        '''
+        Yield every PR matching a search query, fetched graphql_batch_size at
+        a time with everything PullRequest needs in the same query. PRs
+        touching more files than one query returns are fetched over REST
+        instead.
+        '''
+        cursor = None
+        while True:
+            with phase('search'):
+                res = (await self.graphql(
+                    SEARCH_PULL_REQUESTS,
+                    q=query,
+                    first=self.graphql_batch_size,
+                    after=cursor))['search']
+
+            prs = []
+            for node in res['nodes']:
+                if node['files']['pageInfo']['hasNextPage']:
+                    prs.append(asyncio.ensure_future(self.get_pr(node['url'])))
+                    continue
+
+                pr = PullRequest(*pr_from_graphql(node))
+                if self.store is not None:
+                    self.store.put(pr)
+                prs.append(self._remember_pr(pr))
+
+            for pr in prs:
+                yield await pr
+
+            if not res['pageInfo']['hasNextPage']:
+                break
+            cursor = res['pageInfo']['endCursor']
+
+    def _remember_pr(self, pr):
+        '''Let later get_pr calls reuse a PR we got some other way.'''
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(pr)
+        return self.prs.setdefault(pr.pr['url'].lower(), future)
+
+    async def get_pr(self, pr, allow_non_ansible_ansible=True,
+                     updated_at=None) -> PullRequest:
+        '''
+        Fetch a PR and its per-file line counts. If we know when the PR was
+        last updated (e.g. from search results) and have it stored from that
+        version, the stored copy is used instead.
+        '''
+        url = normalize_pr_url(
+            pr,
+            allow_non_ansible_ansible=allow_non_ansible_ansible,
+            api=True)
+
+        # Owners and repos are case-insensitive on GitHub.
+        key = url.lower()
+        task = self.prs.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_pr(url, updated_at))
+            task.add_done_callback(
+                functools.partial(self._forget_failed_pr, key))
+            self.prs[key] = task
+
+        # Shield the shared task so that one caller being cancelled doesn't
+        # cancel it for everyone else waiting on the same PR.
+        return await asyncio.shield(task)
+
+    @in_phase('get_pr')
+    async def _fetch_pr(self, url, updated_at=None):
+        if self.store is not None and updated_at is not None:
+            pr = self.store.get(url, updated_at)
+            if pr is not None:
+                return pr
+
+        if self._is_not_pr(url):
+            raise NotAPullRequest(url)
+
+        try:
+            pr_dict = await self.get(url)
+        except GitHubAPIError as e:
+            if e.status == 404:
+                self._mark_not_pr(url)
+            raise
+        pr = PullRequest(pr_dict, await self.get_file_stats(pr_dict))
+        if self.store is not None:
+            self.store.put(pr)
+        return pr
+
+    @in_phase('diff')
+    async def get_file_stats(self, pr_dict):
+        '''
+        Get per-file line counts for a PR (given as its API response) without
+        building a PatchSet.
+        '''
+        if self.file_stats_from == 'api':
+            files = await self.get_all_pages(
+                '{0}/files?per_page=100'.format(pr_dict['url']))
+            return [
+                FileStat(f['filename'], f['additions'], f['deletions'])
+                for f in files
+            ]
+        stats = await self.get_summary(pr_dict['diff_url'], count_diff)
+        return [FileStat(*stat) for stat in stats]
+
+    @in_phase('diff')
+    async def get_diff(self, pr) -> PatchSet:
+        '''
+        Fetch and parse the full diff of a PR, for when line counts aren't
+        enough.
+        '''
+        if not isinstance(pr, PullRequest):
+            pr = await self.get_pr(pr)
+        return PatchSet(await self.get(pr.pr['diff_url'], json=False))
+
+    def _is_not_pr(self, url):
+        if url.lower() in self.not_prs:
+            return True
+        return self.store is not None and \
+            self.store.is_not_pr(url, self.not_pr_ttl)
+
+    def _mark_not_pr(self, url):
+        self.not_prs.add(url.lower())
+        if self.store is not None:
+            self.store.put_not_pr(url)
+
+    @in_phase('classify')
+    async def classify_pr_references(self, refs):
+        '''
+        Find out which of ``refs`` (anything get_pr takes) aren't PRs, with
+        one GraphQL query for all of the ones we don't already know about,
+        and remember them so that get_pr doesn't ask GitHub about them.
+        '''
+        unknown = {}
+        for ref in refs:
+            try:
+                url = normalize_pr_url(
+                    ref,
+                    allow_non_ansible_ansible=True,
+                    api=True)
+            except Exception:
+                continue
+            key = url.lower()
+            if key in self.prs or self._is_not_pr(url):
+                continue
+            if self.store is not None and self.store.get(url) is not None:
+                continue
+            match = API_PULL_URL_RE.match(url)
+            if match:
+                unknown[key] = match
+
+        if not unknown:
+            return
+
+        # Ask each repository for every number at once, aliasing everything
+        # so that the answers can be matched back up.
+        repos = {}
+        for key, match in unknown.items():
+            repo = (match.group('user'), match.group('repo'))
+            repos.setdefault(repo, []).append(key)
+
+        fields = []
+        aliases = {}
+        for r, ((user, repo), keys) in enumerate(repos.items()):
+            numbers = []
+            for n, key in enumerate(keys):
+                alias = 'n{0}'.format(n)
+                aliases[key] = ('r{0}'.format(r), alias)
+                numbers.append(
+                    '{0}: issueOrPullRequest(number: {1}) {{ __typename }}'.format(
+                        alias,
+                        unknown[key].group('ticket')))
+            fields.append('r{0}: repository(owner: {1}, name: {2}) {{ {3} }}'.format(
+                r,
+                json.dumps(user),
+                json.dumps(repo),
+                ' '.join(numbers)))
 
-    async def guess_original_pr(self, q):
+        # Missing repos and numbers come back as NOT_FOUND errors alongside
+        # the data. Anything else coming back null (FORBIDDEN, a timeout...)
+        # tells us nothing, so get_pr is left to find out about those.
+        data, errors = await self.graphql_with_errors(
+            'query {{ {0} }}'.format(' '.join(fields)))
+        if data is None:
+            return
+        not_found = {
+            tuple(error.get('path') or ())
+            for error in errors or ()
+            if error.get('type') == 'NOT_FOUND'
+        }
+
+        for key, (repo_alias, alias) in aliases.items():
+            repo = data.get(repo_alias)
+            node = repo.get(alias) if repo is not None else None
+            if node is not None:
+                is_pr = node['__typename'] == 'PullRequest'
+            else:
+                is_pr = (repo_alias,) not in not_found and \
+                    (repo_alias, alias) not in not_found
+            if not is_pr:
+                self._mark_not_pr(unknown[key].group(0))
+
+    def _forget_failed_pr(self, key, task):
+        # Don't remember failures, a later caller might have better luck.
+        if task.cancelled() or task.exception() is not None:
+            if self.prs.get(key) is task:
+                del self.prs[key]
+
+    async def guess_original_pr(self, q, limit=None):
         '''
         Do magic. It will search the PR (the newest PR - the backport) and try
         to find where it originated.
@@ -155,6 +578,10 @@ class BackportFinder(GitHubAPICall):
         which is a list of dicts (API results) for each potential PR. The head
         of the PR is most likely candidate, if you can only use one result, but
         correctness is not guaranteed.
+
+        Every reference is looked up at once. If ``limit`` is given, at most
+        that many possibilities are returned, and lookups of less likely ones
+        are cancelled as soon as the most likely ones are found.
         '''
 
         if isinstance(q, PullRequest):
@@ -162,57 +589,118 @@ class BackportFinder(GitHubAPICall):
         else:
             pr = await self.get_pr(q)
 
-        possibilities = []
+        if self.store is not None:
+            stored = self._stored_originals(pr, limit)
+            if stored is not None:
+                return stored
 
-        # 1. Try searching for it in the title.
-        title_search = PULL_BACKPORT_IN_TITLE.search(pr.pr['title'])
-        if title_search:
-            ticket = title_search.group('ticket')
-            try:
-                possibility = await self.get_pr(ticket)
-                if possibility.number != pr.number:
-                    possibilities.append(possibility)
-            except Exception:
-                pass
-
-        # 2. Search for clues in the body of the PR
-        body_lines = pr.pr['body'].split('\n')
-        for line in body_lines:
-            # a. Try searching for a `git cherry-pick` line
-            cherrypick = PULL_CHERRY_PICKED_FROM.match(line)
-            if cherrypick:
-                prs = await self.prs_for_commit(cherrypick.group('hash'))
-                for possibility in prs:
-                    if possibility.number != pr.number:
-                        possibilities.append(possibility)
-                continue
+        references = extract_references(pr.pr['title'], pr.pr['body'] or '')
 
-            # b. Try searching for a full link to another commit
-            commit_link = COMMIT_HTTP_URL_RE.search(line)
-            if commit_link:
-                prs = await self.prs_for_commit(commit_link.group('hash'))
-                for possibility in prs:
+        # The most likely reference (usually the title's "(#nnnn)") and
+        # commits are looked up straight away. The other PR references wait
+        # for one query, made alongside, to rule out the ones that are issues.
+        classified = None
+        if self.classify_references:
+            held = [
+                ref for ref in references[1:]
+                if not isinstance(ref, CommitRef)
+            ]
+            if held:
+                classified = asyncio.ensure_future(
+                    self._classify_quietly(held))
+
+        # Look everything up at once, but go through the results in order of
+        # how likely they are to be the original.
+        lookups = [
+            asyncio.ensure_future(self._lookup(
+                ref,
+                after=None if idx == 0 or isinstance(ref, CommitRef)
+                else classified))
+            for idx, ref in enumerate(references)
+        ]
+        possibilities = []
+        complete = True
+        # Whether every lookup we went by gave a real answer, so that what
+        # we found can be stored as the answer for this version of the PR.
+        answered = True
+        try:
+            for idx, lookup in enumerate(lookups):
+                found = await lookup
+                if found is None:
+                    answered = False
+                    continue
+                for possibility in found:
                     if possibility.number != pr.number:
                         possibilities.append(possibility)
-                continue
+                if limit is not None and len(possibilities) >= limit:
+                    # Only the whole answer if nothing was cut off it.
+                    complete = idx == len(lookups) - 1 and \
+                        len(possibilities) == limit
+                    possibilities = possibilities[:limit]
+                    break
+        finally:
+            # Anything still running can't change the answer any more.
+            pending = lookups + ([classified] if classified else [])
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
 
-            # c. Try searching for other referenced PRs (by #nnnnn or full URL)
-            tickets = [
-                ('ansible', 'ansible', ticket)
-                for ticket in TICKET_NUMBER.findall(line)
-            ]
-            tickets.extend(PULL_HTTP_URL_RE.findall(line))
-            tickets.extend(PULL_URL_RE.findall(line))
-            if tickets:
-                for ticket in tickets:
-                    # Is it a PR (even if not in ansible/ansible)?
-                    try:
-                        pr_url = '{0}/{1}#{2}'.format(ticket[0], ticket[1], ticket[2])
-                        possibility = await self.get_pr(pr_url)
-                        if possibility.number != pr.number:
-                            possibilities.append(possibility)
-                    except Exception:
-                        pass
-                continue  # Future-proofing
+        if self.store is not None and answered:
+            self.store.put_originals(
+                pr,
+                possibilities,
+                limit=None if complete else limit)
 
         return possibilities
+
+    async def _classify_quietly(self, refs):
+        # Classifying only saves requests, so get_pr can find out instead.
+        try:
+            await self.classify_pr_references(refs)
+        except Exception as e:
+            log.warning('Could not classify references: %s', e)
+
+    async def _lookup(self, ref, after=None):
+        '''
+        The PRs a reference (to a PR, even if not in ansible/ansible, or a
+        commit) points at. Returns None if we couldn't find out, e.g. GitHub
+        failed or timed out, as opposed to there being none. If given a task,
+        ``after``, waits for it first.
+        '''
+        if after is not None:
+            # Shared with the other lookups, so don't cancel it with us.
+            await asyncio.shield(after)
+        try:
+            if isinstance(ref, CommitRef):
+                return await self.prs_for_commit(ref.sha)
+            return [await self.get_pr(ref)]
+        except NotAPullRequest:
+            return []
+        except GitHubAPIError as e:
+            if e.status == 404:
+                return []
+            log.warning('%s', e)
+            return None
+        except Exception as e:
+            log.warning('Could not look up %s: %s', ref, e)
+            return None
+
+    def _stored_originals(self, pr, limit=None):
+        '''
+        Return the originals we found for a backport last time, if it hasn't
+        been updated since and we still have all of them stored.
+        '''
+        urls = self.store.get_originals(pr, limit)
+        if urls is None:
+            return None
+
+        originals = []
+        for url in urls:
+            original = self.store.get(url)
+            if original is None:
+                return None
+            originals.append(original)
+
+        for original in originals:
+            self._remember_pr(original)
+        return originals
@@ -0,0 +1,117 @@
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+import os.path
+import sqlite3
+from typing import Optional
+
+@dataclass
+class CachedResponse:
+    '''
+    A response body along with the validators GitHub gave us for it, so that
+    we can ask GitHub whether it changed instead of downloading it again.
+    '''
+    body: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    link: Optional[str] = None
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class ResponseCache:
+    '''
+    Base class for on-disk response caches. Subclasses store one
+    CachedResponse per endpoint.
+    '''
+    def get(self, endpoint) -> Optional[CachedResponse]:
+        raise NotImplementedError
+
+    def put(self, endpoint, response: CachedResponse):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SQLiteResponseCache(ResponseCache):
+    '''Keeps every cached response in a single SQLite database.'''
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'endpoint TEXT PRIMARY KEY, '
+            'body TEXT NOT NULL, '
+            'etag TEXT, '
+            'last_modified TEXT, '
+            'link TEXT)')
+
+    def get(self, endpoint):
+        row = self.db.execute(
+            'SELECT body, etag, last_modified, link FROM responses '
+            'WHERE endpoint = ?',
+            (endpoint,)).fetchone()
+        if row is None:
+            return None
+        return CachedResponse(*row)
+
+    def put(self, endpoint, response):
+        self.db.execute(
+            'INSERT OR REPLACE INTO responses '
+            '(endpoint, body, etag, last_modified, link) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (endpoint,
+             response.body,
+             response.etag,
+             response.last_modified,
+             response.link))
+
+    def close(self):
+        self.db.close()
+
+class DirectoryResponseCache(ResponseCache):
+    '''Keeps each cached response in its own JSON file in a directory.'''
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _filename(self, endpoint):
+        digest = hashlib.sha256(endpoint.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.json')
+
+    def get(self, endpoint):
+        try:
+            with open(self._filename(endpoint)) as f:
+                return CachedResponse(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def put(self, endpoint, response):
+        filename = self._filename(endpoint)
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(asdict(response), f)
+        os.replace(tmp, filename)
+
+def open_cache(path):
+    '''
+    Open the response cache at ``path``. Paths ending in ``.sqlite`` or
+    ``.db`` are SQLite databases, anything else is treated as a directory.
+    Returns None if ``path`` is empty, which disables caching.
+
+    >>> open_cache('') is None
+    True
+    '''
+    if not path:
+        return None
+    if path.endswith(('.sqlite', '.db')):
+        return SQLiteResponseCache(path)
+    return DirectoryResponseCache(path)
@@ -0,0 +1,157 @@
+import os
+import os.path
+import re
+import sqlite3
+import subprocess
+from typing import List, Tuple
+
+SQUASH_SUBJECT = re.compile(r'\(#(?P<number>\d+)\)$')
+MERGE_SUBJECT = re.compile(r'^Merge pull request #(?P<number>\d+) from ')
+PULL_HEAD_REF = re.compile(r'^refs/pull/(?P<number>\d+)/head$')
+# Mirrors keep branches in refs/heads, ordinary clones in refs/remotes.
+BRANCH_REFS = ('refs/heads/', 'refs/remotes/')
+
+class CommitIndex:
+    '''
+    Maps commit SHAs to the PRs they came from, built from local clones of
+    our repos rather than GitHub's commit search. A commit is counted as
+    coming from PR N if it is:
+
+      - a squash or rebase merge whose subject ends in "(#N)",
+      - the merge commit of "Merge pull request #N from ...", or the head of
+        the branch it merged,
+      - the head of refs/pull/N/head (which `git clone --mirror` fetches).
+
+    update() only walks commits it hasn't seen before, so keeping the index
+    current costs about as much as the fetch itself.
+    '''
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS commits ('
+            'sha TEXT NOT NULL, '
+            'repo TEXT NOT NULL, '
+            'number INTEGER NOT NULL, '
+            'PRIMARY KEY (sha, repo, number))')
+        # The tip of every ref as of the last update, so the next one knows
+        # where to stop.
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS refs ('
+            'repo TEXT NOT NULL, '
+            'ref TEXT NOT NULL, '
+            'sha TEXT NOT NULL, '
+            'PRIMARY KEY (repo, ref))')
+
+    def lookup(self, sha) -> List[Tuple[str, int]]:
+        '''
+        Return the (repo, PR number) pairs a commit came from. ``sha`` may be
+        abbreviated.
+        '''
+        sha = sha.lower()
+        rows = self.db.execute(
+            'SELECT DISTINCT repo, number FROM commits '
+            'WHERE sha >= ? AND sha < ? ORDER BY repo, number',
+            (sha, sha + 'g'))
+        return [(repo, number) for repo, number in rows]
+
+    def update(self, repo, git_dir, fetch=False):
+        '''
+        Index whatever is new in the clone of ``repo`` (e.g. 'ansible/ansible')
+        at ``git_dir``, fetching first if asked to.
+        '''
+        if fetch:
+            git(git_dir, 'fetch', '--prune', '--quiet')
+
+        old = dict(self.db.execute(
+            'SELECT ref, sha FROM refs WHERE repo = ?',
+            (repo,)).fetchall())
+        new = {}
+        refs = git(
+            git_dir, 'for-each-ref', '--format=%(objectname) %(refname)',
+            'refs/heads', 'refs/remotes', 'refs/pull')
+        for line in refs.splitlines():
+            sha, ref = line.split(' ', 1)
+            new[ref] = sha
+
+        found = []
+        changed = [ref for ref, sha in new.items() if old.get(ref) != sha]
+
+        for ref in changed:
+            match = PULL_HEAD_REF.match(ref)
+            if match:
+                found.append((new[ref], int(match.group('number'))))
+
+        tips = [
+            new[ref]
+            for ref in changed
+            if ref.startswith(BRANCH_REFS) and not ref.endswith('/HEAD')
+        ]
+        if tips:
+            # Only branches are walked, so only their old tips are known to
+            # have been indexed already. After a force-push (and a gc) an old
+            # tip can be gone, and git log won't take a revision it can't
+            # find.
+            seen = set(
+                '^' + sha
+                for sha in existing(git_dir, set(
+                    sha for ref, sha in old.items()
+                    if ref.startswith(BRANCH_REFS))))
+            log = git(
+                git_dir, 'log', '--format=%H %P%x00%s', '--stdin',
+                input='\n'.join(tips + sorted(seen)))
+            for line in log.splitlines():
+                shas, subject = line.split('\0', 1)
+                shas = shas.split()
+                match = SQUASH_SUBJECT.search(subject)
+                if match:
+                    found.append((shas[0], int(match.group('number'))))
+                    continue
+                match = MERGE_SUBJECT.match(subject)
+                if match:
+                    number = int(match.group('number'))
+                    found.append((shas[0], number))
+                    if len(shas) > 2:
+                        found.append((shas[2], number))
+
+        self.db.execute('BEGIN')
+        try:
+            self.db.executemany(
+                'INSERT OR IGNORE INTO commits (sha, repo, number) '
+                'VALUES (?, ?, ?)',
+                [(sha, repo, number) for sha, number in found])
+            self.db.execute('DELETE FROM refs WHERE repo = ?', (repo,))
+            self.db.executemany(
+                'INSERT INTO refs (repo, ref, sha) VALUES (?, ?, ?)',
+                [(repo, ref, sha) for ref, sha in new.items()])
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+        return len(found)
+
+    def close(self):
+        self.db.close()
+
+def git(git_dir, *args, input=None):
+    '''Run git in ``git_dir`` and return what it printed.'''
+    return subprocess.run(
+        ['git', '-C', git_dir] + list(args),
+        input=input,
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True).stdout
+
+def existing(git_dir, shas):
+    '''The ones of ``shas`` which are objects in the repository at ``git_dir``.'''
+    if not shas:
+        return set()
+    out = git(
+        git_dir, 'cat-file', '--batch-check=%(objectname)',
+        input='\n'.join(sorted(shas)))
+    return set(
+        line for line in out.splitlines()
+        if not line.endswith(' missing'))
@@ -0,0 +1,53 @@
+import time
+
+class ContextCache:
+    '''
+    Page contexts (page name -> context) kept in memory between renders.
+
+    ``fetch`` is called with a list of page names and returns their
+    contexts, leaving out pages which have none. A page's context is fetched
+    again when it is asked for and more than ``ttl`` seconds old (never, if
+    ``ttl`` is None), or for every page when refresh() is called. Anything
+    else is served from memory, so re-rendering after a template change
+    doesn't fetch anything.
+    '''
+    def __init__(self, fetch, ttl=None, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self.contexts = {}
+        # page name -> when its context was fetched
+        self.fetched_at = {}
+
+    def update(self, contexts, names=None):
+        '''
+        Store freshly fetched ``contexts``. ``names`` are the pages that
+        were asked for, so that pages without a context aren't asked for
+        again until they expire.
+        '''
+        now = self.clock()
+        for name in set(contexts) | set(names or ()):
+            self.contexts[name] = contexts.get(name, {})
+            self.fetched_at[name] = now
+
+    def expired(self, name):
+        if name not in self.fetched_at:
+            return True
+        if self.ttl is None:
+            return False
+        return self.clock() - self.fetched_at[name] >= self.ttl
+
+    def get(self, name, default=None):
+        if self.expired(name):
+            self.update(self.fetch([name]), [name])
+        return self.contexts.get(name, default)
+
+    def expire(self):
+        '''Have every page fetched again the next time it's asked for.'''
+        self.fetched_at.clear()
+
+    def refresh(self, names=None):
+        '''Fetch ``names`` (or every page we have) again, now.'''
+        if names is None:
+            names = list(self.contexts)
+        self.update(self.fetch(names), names)
@@ -0,0 +1,155 @@
+import re
+from releasible.model.pullrequest import FileStat
+
+DIFF_GIT_HEADER = re.compile(r'^diff --git (?P<source>\S+) (?P<target>\S+)$')
+HUNK_HEADER = re.compile(
+    r'^@@ -\d+(?:,(?P<source_length>\d+))? \+\d+(?:,(?P<target_length>\d+))? @@')
+PATCH_FILE_PREFIX = re.compile(r'^[abciow12]/')
+DEV_NULL = '/dev/null'
+
+class DiffStatCounter:
+    '''
+    Counts added and removed lines per file in a unified diff, one line at a
+    time, without keeping the diff or building hunk/line objects like
+    unidiff's PatchSet does. Paths are worked out the same way as
+    PatchedFile.path.
+
+    feed() returns a FileStat whenever a line finishes the previous file, and
+    finish() returns the last one.
+    '''
+    def __init__(self):
+        self.source = None
+        self.target = None
+        self.is_rename = False
+        self.added = 0
+        self.removed = 0
+        self.source_left = 0
+        self.target_left = 0
+
+    def _start(self, source, target):
+        done = self.finish()
+        self.source = source
+        self.target = target
+        self.is_rename = False
+        self.added = 0
+        self.removed = 0
+        return done
+
+    def feed(self, line):
+        line = line.rstrip('\r\n')
+
+        if self.source_left > 0 or self.target_left > 0:
+            # Inside a hunk, the header told us how many lines are left, so a
+            # removed line that happens to start with '--' is still a line.
+            if line.startswith('\\'):
+                return None
+            if line.startswith('+'):
+                self.added += 1
+                self.target_left -= 1
+            elif line.startswith('-'):
+                self.removed += 1
+                self.source_left -= 1
+            else:
+                self.source_left -= 1
+                self.target_left -= 1
+            return None
+
+        match = HUNK_HEADER.match(line)
+        if match:
+            self.source_left = int(match.group('source_length') or 1)
+            self.target_left = int(match.group('target_length') or 1)
+            return None
+
+        match = DIFF_GIT_HEADER.match(line)
+        if match:
+            return self._start(match.group('source'), match.group('target'))
+
+        if line.startswith('--- '):
+            filename = line[4:].split('\t')[0]
+            # Plain (non-git) diffs start each file with ---
+            done = None
+            if self.source is None or self.added or self.removed:
+                done = self._start(filename, None)
+            self.source = filename
+            return done
+
+        if line.startswith('+++ '):
+            self.target = line[4:].split('\t')[0]
+        elif line.startswith('rename from ') or line.startswith('rename to '):
+            self.is_rename = True
+
+        return None
+
+    def finish(self):
+        '''Return the FileStat for the file being counted, if there is one.'''
+        if self.source is None and self.target is None:
+            return None
+
+        path = self.source
+        if path in (None, DEV_NULL) or \
+                (self.is_rename and self.target not in (None, DEV_NULL)):
+            path = self.target
+
+        quoted = path.startswith('"') and path.endswith('"')
+        if quoted:
+            path = path[1:-1]
+        if PATCH_FILE_PREFIX.match(path):
+            path = path[2:]
+        if quoted:
+            path = '"{0}"'.format(path)
+
+        self.source = None
+        self.target = None
+        return FileStat(path, self.added, self.removed)
+
+def file_stats(diff):
+    '''
+    Count the lines added and removed per file in the text of a unified diff.
+
+    >>> file_stats("""diff --git a/lib/foo.py b/lib/foo.py
+    ... --- a/lib/foo.py
+    ... +++ b/lib/foo.py
+    ... @@ -1,2 +1,2 @@
+    ... --- a YAML document start, removed
+    ... +bar
+    ...  baz
+    ... """)
+    [FileStat(path='lib/foo.py', added=1, removed=1)]
+    '''
+    counter = DiffStatCounter()
+    out = []
+    for line in diff.splitlines():
+        done = counter.feed(line)
+        if done is not None:
+            out.append(done)
+
+    done = counter.finish()
+    if done is not None:
+        out.append(done)
+    return out
+
+async def iter_file_stats(lines):
+    '''
+    Count the lines added and removed per file in a unified diff given as an
+    async iterator of lines, yielding each FileStat as soon as its file is
+    done.
+    '''
+    counter = DiffStatCounter()
+    async for line in lines:
+        done = counter.feed(line)
+        if done is not None:
+            yield done
+
+    done = counter.finish()
+    if done is not None:
+        yield done
+
+async def count_diff(lines):
+    '''
+    Summarize a streamed diff as a JSON-friendly list of
+    ``[path, added, removed]`` per file, for GitHubAPICall.get_summary.
+    '''
+    return [
+        [stat.path, stat.added, stat.removed]
+        async for stat in iter_file_stats(lines)
+    ]
@@ -1,64 +1,612 @@
+import asyncio
+import collections
+import contextlib
+from dataclasses import dataclass
+from json import dumps, loads
+import logging
 import re
+import time
+from typing import Optional
+from releasible.cache import CachedResponse
+from releasible.trace import RequestRecord, current_phase
+
+log = logging.getLogger(__name__)
+
+@dataclass
+class RateLimit:
+    '''What we know about one rate limit bucket (of one token).'''
+    remaining: int
+    # When it resets, as a unix timestamp.
+    reset: int
+    # How many requests it allows per window, if we were told.
+    limit: Optional[int] = None
+    # When the next paced request may be sent, so that paced requests go
+    # out one after another rather than all at once.
+    next_send: float = 0.0
+
+class RequestScheduler:
+    '''
+    Paces requests to GitHub so that we can push as hard as the token allows
+    without tripping the rate limits.
+
+    At most ``max_concurrency`` requests are in flight at once. The
+    X-RateLimit-* headers of every response are tracked per resource (core,
+    search, graphql); once less than ``reserve`` (a fraction of the limit) is
+    left, requests are spaced out evenly over the time until it resets, and
+    when it runs out we wait for the reset. Waiting happens before taking a
+    slot, so requests held back by one resource don't hold up the others.
+    403/429 responses caused by rate limiting are retried, honouring
+    Retry-After and otherwise backing off exponentially.
+    '''
+    def __init__(self, max_concurrency=10, max_retries=5, backoff=1.0,
+                 reserve=0.1):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.reserve = reserve
+
+        # resource -> RateLimit
+        self.limits = {}
+        # Set by Retry-After; nothing is sent before this unix timestamp.
+        self.paused_until = 0
+
+        self.requests = 0
+        self.retries = 0
+        self.waited = 0.0
+        self.first_request = None
+        self.last_response = None
+
+    @staticmethod
+    def resource(endpoint):
+        '''
+        Guess which rate limit bucket a request is counted against.
+
+        >>> RequestScheduler.resource('https://api.github.com/search/issues?q=a')
+        'search'
+        >>> RequestScheduler.resource('https://api.github.com/repos/a/b/pulls/1')
+        'core'
+        >>> RequestScheduler.resource('https://github.com/a/b/pull/1.diff') is None
+        True
+        '''
+        if not endpoint.startswith('https://api.github.com/'):
+            return None
+        if endpoint.startswith('https://api.github.com/search/'):
+            return 'search'
+        if endpoint.startswith('https://api.github.com/graphql'):
+            return 'graphql'
+        return 'core'
+
+    def delay_for(self, endpoint, limits=None):
+        '''
+        How long to hold off before sending a request to ``endpoint``. A
+        paced request books its turn, so the next one is told to wait
+        longer. ``limits`` are the rate limits of the token it'll be sent
+        with, if not ours (see TokenPool).
+        '''
+        if limits is None:
+            limits = self.limits
+        now = time.time()
+        delay = max(0, self.paused_until - now)
+
+        limit = limits.get(self.resource(endpoint))
+        if limit is None or limit.reset <= now:
+            return delay
+        if limit.remaining <= 0:
+            return max(delay, limit.reset - now + 1)
+        if limit.limit is not None and \
+                limit.remaining < limit.limit * self.reserve:
+            # Spread what's left evenly over the rest of the window.
+            send_at = max(now + delay, limit.next_send)
+            limit.next_send = send_at + (limit.reset - now) / limit.remaining
+            delay = send_at - now
+        return delay
+
+    @contextlib.asynccontextmanager
+    async def slot(self, endpoint, limits=None):
+        delay = self.delay_for(endpoint, limits)
+        if delay > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+        async with self.semaphore:
+            if self.first_request is None:
+                self.first_request = time.monotonic()
+            self.requests += 1
+            try:
+                yield
+            finally:
+                self.last_response = time.monotonic()
+
+    def update(self, endpoint, headers, limits=None):
+        if limits is None:
+            limits = self.limits
+        remaining = headers.get('x-ratelimit-remaining')
+        reset = headers.get('x-ratelimit-reset')
+        if remaining is None or reset is None:
+            return
+        resource = headers.get('x-ratelimit-resource') or \
+            self.resource(endpoint)
+        limit = headers.get('x-ratelimit-limit')
+
+        known = limits.get(resource)
+        if known is None:
+            known = limits[resource] = RateLimit(int(remaining), int(reset))
+        known.remaining = int(remaining)
+        known.reset = int(reset)
+        if limit is not None:
+            known.limit = int(limit)
+
+    def retry_delay(self, status, headers, text, attempt):
+        '''
+        Return how long to wait before retrying a failed request, or None if
+        it shouldn't be retried.
+        '''
+        if status not in (403, 429) or attempt >= self.max_retries:
+            return None
+
+        retry_after = headers.get('retry-after')
+        if retry_after is not None:
+            delay = int(retry_after)
+            self.paused_until = max(self.paused_until, time.time() + delay)
+            return delay
+
+        if headers.get('x-ratelimit-remaining') == '0':
+            reset = int(headers.get('x-ratelimit-reset', 0))
+            return max(0, reset - time.time()) + 1
+
+        # A 403 which isn't about rate limiting is a real error.
+        if status == 403 and 'rate limit' not in text.lower():
+            return None
+
+        return self.backoff * 2 ** attempt
+
+    def throughput(self):
+        '''Completed requests per second since the first one was sent.'''
+        if self.first_request is None or self.last_response is None:
+            return 0.0
+        elapsed = self.last_response - self.first_request
+        if elapsed <= 0:
+            return 0.0
+        return self.requests / elapsed
+
+class TokenPool:
+    '''
+    Several tokens to spread requests over. Each token has its own rate
+    limits, tracked per resource (core, search, graphql) in the same shape
+    as RequestScheduler.limits, and each request goes out with whichever
+    token has the most of that resource's budget left.
+    '''
+    def __init__(self, tokens):
+        self.tokens = list(dict.fromkeys(tokens))
+        if not self.tokens:
+            raise ValueError('A TokenPool needs at least one token')
+        # token -> resource -> RateLimit
+        self.limits = {token: {} for token in self.tokens}
+        # token -> requests sent with it that haven't been answered yet
+        self.in_flight = collections.Counter()
+
+    def headroom(self, token, resource):
+        '''
+        How many more requests for ``resource`` we think ``token`` has, less
+        those in flight. A token we haven't heard about since its last
+        reset is assumed to have plenty.
+        '''
+        limit = self.limits[token].get(resource)
+        if limit is None or limit.reset <= time.time():
+            remaining = float('inf')
+        else:
+            remaining = limit.remaining
+        return remaining - self.in_flight[token]
+
+    def choose(self, resource):
+        '''
+        The token with the most headroom for ``resource``, or of those with
+        plenty, the one with the fewest requests in flight.
+
+        >>> pool = TokenPool(['a', 'b'])
+        >>> pool.limits['a']['search'] = RateLimit(3, time.time() + 60)
+        >>> pool.choose('search'), pool.choose('core')
+        ('b', 'a')
+        '''
+        return max(
+            self.tokens,
+            key=lambda token: (
+                self.headroom(token, resource),
+                -self.in_flight[token]))
+
+    @contextlib.contextmanager
+    def checkout(self, resource):
+        '''
+        Choose a token for a request, yielding it and its limits for the
+        scheduler to pace and update.
+        '''
+        token = self.choose(resource)
+        self.in_flight[token] += 1
+        try:
+            yield token, self.limits[token]
+        finally:
+            self.in_flight[token] -= 1
+
+class GitHubAPIError(Exception):
+    '''A request to GitHub came back with a status we didn't expect.'''
+    def __init__(self, endpoint, status, text):
+        super().__init__(
+            '{0} got status {1}: {2}'.format(endpoint, status, text))
+        self.endpoint = endpoint
+        self.status = status
+
+# Where GitHub's API and web URLs start, for GitHubAPICall.route().
+GITHUB_ROOTS = ('https://api.github.com/', 'https://github.com/')
 
 class GitHubAPICall:
-    def __init__(self, token, aio_session):
+    def __init__(self, token, aio_session, cache=None, scheduler=None,
+                 tracer=None, server=None):
+        # Either one token, or a TokenPool to spread requests over.
         self.token = token
         self.aio_session = aio_session
-        self.link = None
+        # Another server to send GitHub's requests to, e.g.
+        # http://localhost:8000 for test/fakegithub.py.
+        self.server = server and server.rstrip('/')
+        self.cache = cache
+        self.scheduler = scheduler or RequestScheduler()
+        # A releasible.trace.Tracer to record every request to, if any.
+        self.tracer = tracer
         self.calls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_revalidations = 0
 
-    async def get(self, endpoint, json=True):
-        print(endpoint)
-        async with self.aio_session.get(
+    def route(self, endpoint):
+        '''
+        The URL to actually send a request for ``endpoint`` to. Everything
+        else (caching, rate limits, tracing) goes by ``endpoint`` itself.
+
+        >>> GitHubAPICall(None, None, server='http://localhost:8000/').route(
+        ...     'https://github.com/ansible/ansible/pull/1.diff')
+        'http://localhost:8000/ansible/ansible/pull/1.diff'
+        '''
+        if self.server is None:
+            return endpoint
+        for root in GITHUB_ROOTS:
+            if endpoint.startswith(root):
+                return '{0}/{1}'.format(self.server, endpoint[len(root):])
+        return endpoint
+
+    @contextlib.contextmanager
+    def checkout(self, endpoint):
+        '''
+        Yield the token to send a request to ``endpoint`` with, and its rate
+        limits if it's from a TokenPool (otherwise the scheduler tracks
+        them).
+        '''
+        if not isinstance(self.token, TokenPool):
+            yield self.token, None
+            return
+        with self.token.checkout(self.scheduler.resource(endpoint)) as out:
+            yield out
+
+    @contextlib.contextmanager
+    def trace(self, endpoint, method='GET'):
+        '''
+        Yield a RequestRecord for a request to fill in, which is kept by the
+        tracer (if there is one) once the block is done.
+        '''
+        log.info('%s %s', method, endpoint)
+        record = RequestRecord(
             endpoint,
-            headers={
-                'Authorization': 'token {0}'.format(self.token),
-                'Accept': (
-                    'application/vnd.github.cloak-preview, '
-                    'application/vnd.github.groot-preview+json, '
-                    'application/vnd.github.v3+json'
-                ),
-            }
-        ) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise Exception(
-                    '{0} got status {1}: {2}'.format(
-                        endpoint,
-                        resp.status,
-                        text))
-
-            self.calls += 1
-            self.link = resp.headers.get('link')
-
-            if json:
-                return await resp.json()
-            return await resp.text()
+            method,
+            phase=current_phase.get(),
+            start=time.monotonic())
+        try:
+            yield record
+        finally:
+            if self.tracer is not None:
+                self.tracer.finish(record)
 
-    async def get_all_pages(self, endpoint, key=None):
-        req = self.get(endpoint)
-        if key is not None:
-            out = (await req)[key]
-        else:
-            out = req
+    @contextlib.asynccontextmanager
+    async def request(self, endpoint, method='GET', headers=None,
+                      ok=(200,), record=None, **kwargs):
+        '''
+        Send a request through the scheduler and yield the response once it
+        has a status in ``ok``. Requests which were rate limited are retried;
+        any other status raises. If given a RequestRecord, what happened is
+        noted in it.
+        '''
+        if record is None:
+            record = RequestRecord(endpoint, method)
+
+        all_headers = {
+            'Accept': (
+                'application/vnd.github.cloak-preview, '
+                'application/vnd.github.groot-preview+json, '
+                'application/vnd.github.v3+json'
+            ),
+        }
+        all_headers.update(headers or {})
+
+        attempt = 0
+        while True:
+            with self.checkout(endpoint) as (token, limits):
+                async with self.scheduler.slot(endpoint, limits):
+                    if attempt == 0:
+                        # Time the request itself, not waiting for a slot.
+                        record.start = time.monotonic()
+                    async with self.aio_session.request(
+                            method,
+                            self.route(endpoint),
+                            headers=dict(
+                                all_headers,
+                                Authorization='token {0}'.format(token)),
+                            **kwargs) as resp:
+                        self.scheduler.update(endpoint, resp.headers, limits)
+                        record.status = resp.status
+                        record.retries = attempt
+                        remaining = resp.headers.get('x-ratelimit-remaining')
+                        if remaining is not None:
+                            record.remaining = int(remaining)
+                        if resp.status in ok:
+                            yield resp
+                            return
+
+                        text = await resp.text()
+                        delay = self.scheduler.retry_delay(
+                            resp.status,
+                            resp.headers,
+                            text,
+                            attempt)
+                        if delay is None:
+                            raise GitHubAPIError(endpoint, resp.status, text)
+
+                if limits is not None and \
+                        resp.headers.get('x-ratelimit-remaining') == '0':
+                    # This token has run out, but another might not have.
+                    resource = self.scheduler.resource(endpoint)
+                    if self.token.headroom(
+                            self.token.choose(resource),
+                            resource) > 0:
+                        delay = 0
+
+            attempt += 1
+            self.scheduler.retries += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, endpoint, json=True):
+        return (await self.get_with_links(endpoint, json))[0]
+
+    async def get_with_links(self, endpoint, json=True):
+        '''
+        Like get(), but also return the response's Link header parsed into a
+        dict of rel -> URL (see parse_link_header()). Pagination state lives
+        with the caller, so any number of paginated calls can run at once.
+        '''
+        headers = {}
+        ok = (200,)
 
-        next_page = self.next_page_url()
-        while next_page:
-            if key is not None:
-                out += await self.get(next_page)[key]
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(endpoint)
+            if cached is None:
+                self.cache_misses += 1
             else:
-                out += await self.get(next_page)
-            next_page = self.next_page_url()
+                # GitHub doesn't count 304s against the rate limit, so always
+                # ask before downloading something we already have.
+                headers.update(cached.conditional_headers())
+                ok = (200, 304)
+                self.cache_revalidations += 1
+
+        with self.trace(endpoint) as record:
+            async with self.request(
+                    endpoint,
+                    headers=headers,
+                    ok=ok,
+                    record=record) as resp:
+                self.calls += 1
+                if resp.status == 304:
+                    self.cache_hits += 1
+                    record.cache = 'hit'
+                    link = cached.link
+                    body = cached.body
+                else:
+                    link = resp.headers.get('link')
+                    raw = await resp.read()
+                    record.bytes = len(raw)
+                    body = raw.decode(resp.get_encoding())
+                    if self.cache is not None:
+                        record.cache = 'miss' if cached is None else 'stale'
+
+                    etag = resp.headers.get('etag')
+                    last_modified = resp.headers.get('last-modified')
+                    if self.cache is not None and (etag or last_modified):
+                        self.cache.put(
+                            endpoint,
+                            CachedResponse(body, etag, last_modified, link))
+
+        if json:
+            body = loads(body)
+        return body, parse_link_header(link)
+
+    async def iter_lines(self, resp, chunk_size=65536, record=None):
+        '''
+        Yield the body of a response line by line as it arrives, so that we
+        never hold all of it in memory at once. If given a RequestRecord, the
+        bytes read are counted in it.
+        '''
+        partial = b''
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            if record is not None:
+                record.bytes += len(chunk)
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8', 'replace')
+        if partial:
+            yield partial.decode('utf-8', 'replace')
+
+    async def get_summary(self, endpoint, summarize):
+        '''
+        Like get(json=False), but rather than returning the response body,
+        stream its lines into ``summarize`` (an async function taking an async
+        iterator of lines) and return the result. For use on large responses
+        where we only need a few numbers out of them.
+
+        If there's a cache, it's the summary that gets cached, revalidated
+        against the response's ETag like anything else, so it must be
+        JSON-serializable.
+        '''
+        headers = {}
+        ok = (200,)
+
+        cache_key = '{0}#{1}'.format(endpoint, summarize.__name__)
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is None:
+                self.cache_misses += 1
+            else:
+                headers.update(cached.conditional_headers())
+                ok = (200, 304)
+                self.cache_revalidations += 1
+
+        with self.trace(endpoint) as record:
+            async with self.request(
+                    endpoint,
+                    headers=headers,
+                    ok=ok,
+                    record=record) as resp:
+                self.calls += 1
+                if resp.status == 304:
+                    self.cache_hits += 1
+                    record.cache = 'hit'
+                    return loads(cached.body)
 
-        self.link = None
+                lines = self.iter_lines(resp, record=record)
+                summary = await summarize(lines)
+                if self.cache is not None:
+                    record.cache = 'miss' if cached is None else 'stale'
+
+                etag = resp.headers.get('etag')
+                last_modified = resp.headers.get('last-modified')
+                if self.cache is not None and (etag or last_modified):
+                    self.cache.put(
+                        cache_key,
+                        CachedResponse(dumps(summary), etag, last_modified))
+
+        return summary
+
+    async def graphql(self, query, **variables):
+        data, errors = await self.graphql_with_errors(query, **variables)
+        if errors:
+            raise Exception(
+                'https://api.github.com/graphql returned errors: {0}'.format(
+                    errors))
+        return data
+
+    async def graphql_with_errors(self, query, **variables):
+        '''
+        Like graphql(), but return the data along with any errors rather than
+        raising, for queries where some parts failing is expected (like
+        looking up things which might not exist).
+        '''
+        endpoint = 'https://api.github.com/graphql'
+        with self.trace(endpoint, 'POST') as record:
+            async with self.request(
+                    endpoint,
+                    method='POST',
+                    json={'query': query, 'variables': variables},
+                    record=record) as resp:
+                self.calls += 1
+                raw = await resp.read()
+                record.bytes = len(raw)
+                body = raw.decode(resp.get_encoding())
+                out = loads(body)
+
+        return out.get('data'), out.get('errors')
+
+    async def get_all_pages(self, endpoint, key=None):
+        '''
+        Fetch every page of a paginated endpoint and return the concatenated
+        results (of ``key`` in each page, if given).
+        '''
+        return [
+            item
+            async for item in self.iter_pages(endpoint, key, prefetch=None)
+        ]
+
+    async def iter_pages(self, endpoint, key=None, prefetch=4):
+        '''
+        Yield the results of a paginated endpoint (of ``key`` in each page, if
+        given) one at a time, as each page arrives.
+
+        If the first page links to the last one, we know every page URL up
+        front and fetch up to ``prefetch`` pages ahead of the one being
+        consumed (all of them, if ``prefetch`` is None). Otherwise we follow
+        rel="next" one page at a time.
+        '''
+        def items(page):
+            return page[key] if key is not None else page
+
+        first, links = await self.get_with_links(endpoint)
+        for item in items(first):
+            yield item
+
+        if 'next' in links and PAGE_PARAM.search(links.get('last', '')):
+            urls = page_urls(links['next'], links['last'])
+            window = len(urls) if prefetch is None else max(prefetch, 0)
+            pending = collections.deque()
+            try:
+                for url in urls:
+                    pending.append(asyncio.ensure_future(self.get(url)))
+                    if len(pending) > window:
+                        for item in items(await pending.popleft()):
+                            yield item
+                while pending:
+                    for item in items(await pending.popleft()):
+                        yield item
+            finally:
+                for page in pending:
+                    page.cancel()
+            return
+
+        while 'next' in links:
+            page, links = await self.get_with_links(links['next'])
+            for item in items(page):
+                yield item
+
+PAGE_PARAM = re.compile(r'([?&])page=(\d+)')
+
+def parse_link_header(link):
+    '''
+    Parse a Link header into a dict of rel -> URL.
+
+    >>> parse_link_header(
+    ...     '<https://api.github.com/x?page=2>; rel="next", '
+    ...     '<https://api.github.com/x?page=5>; rel="last"')
+    {'next': 'https://api.github.com/x?page=2', 'last': 'https://api.github.com/x?page=5'}
+    >>> parse_link_header(None)
+    {}
+    '''
+    out = {}
+    if not link:
         return out
+    for part in link.split(', '):
+        match = re.match('<(.+)>; rel="(\\w+)"', part)
+        if match:
+            out[match[2]] = match[1]
+    return out
 
-    def next_page_url(self):
-        if not self.link:
-            return None
-        sp = self.link.split(', ')
-        for link in sp:
-            match = re.match('<(.+)>; rel="next"', link)
-            if not match:
-                continue
-            return match[1]
+def page_urls(next_url, last_url):
+    '''
+    List the URLs of every page from ``next_url`` to ``last_url``.
+
+    >>> page_urls(
+    ...     'https://api.github.com/x?per_page=100&page=2',
+    ...     'https://api.github.com/x?per_page=100&page=4')
+    ['https://api.github.com/x?per_page=100&page=2', 'https://api.github.com/x?per_page=100&page=3', 'https://api.github.com/x?per_page=100&page=4']
+    '''
+    first = int(PAGE_PARAM.search(next_url)[2])
+    last = int(PAGE_PARAM.search(last_url)[2])
+    return [
+        PAGE_PARAM.sub(r'\g<1>page={0}'.format(page), last_url)
+        for page in range(first, last + 1)
+    ]
@@ -0,0 +1,121 @@
+from releasible.model.pullrequest import FileStat
+
+# Everything PullRequest and the templates read, for a page of search results.
+SEARCH_PULL_REQUESTS = '''
+query($q: String!, $first: Int!, $after: String) {
+  search(query: $q, type: ISSUE, first: $first, after: $after) {
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    nodes {
+      ... on PullRequest {
+        number
+        title
+        body
+        url
+        createdAt
+        updatedAt
+        baseRefName
+        additions
+        deletions
+        changedFiles
+        author {
+          login
+          url
+        }
+        repository {
+          nameWithOwner
+        }
+        comments {
+          totalCount
+        }
+        reviews(first: 50) {
+          nodes {
+            comments {
+              totalCount
+            }
+          }
+        }
+        commits {
+          totalCount
+        }
+        labels(first: 100) {
+          nodes {
+            name
+          }
+        }
+        files(first: 100) {
+          pageInfo {
+            hasNextPage
+          }
+          nodes {
+            path
+            additions
+            deletions
+          }
+        }
+      }
+    }
+  }
+}
+'''
+
+def pr_from_graphql(node):
+    '''
+    Turn a PullRequest node from SEARCH_PULL_REQUESTS into the (dict, files)
+    pair a PullRequest is made of. The dict is shaped like the REST API's
+    pull request response, filled in as far as the templates and risk scoring
+    need it.
+
+    >>> pr, files = pr_from_graphql({
+    ...     'number': 1, 'title': 't', 'body': '', 'url':
+    ...     'https://github.com/a/b/pull/1', 'createdAt': None,
+    ...     'updatedAt': None, 'baseRefName': 'devel', 'additions': 3,
+    ...     'deletions': 1, 'changedFiles': 1, 'author': None,
+    ...     'repository': {'nameWithOwner': 'a/b'},
+    ...     'comments': {'totalCount': 2}, 'reviews': {'nodes': []},
+    ...     'commits': {'totalCount': 1}, 'labels': {'nodes': []},
+    ...     'files': {'nodes': [
+    ...         {'path': 'lib/x.py', 'additions': 3, 'deletions': 1}]}})
+    >>> pr['url']
+    'https://api.github.com/repos/a/b/pulls/1'
+    >>> files
+    [FileStat(path='lib/x.py', added=3, removed=1)]
+    '''
+    # Deleted accounts come back as a null author.
+    author = node.get('author') or {
+        'login': 'ghost',
+        'url': 'https://github.com/ghost',
+    }
+
+    pr = {
+        'number': node['number'],
+        'title': node['title'],
+        'body': node['body'],
+        'html_url': node['url'],
+        'url': 'https://api.github.com/repos/{0}/pulls/{1}'.format(
+            node['repository']['nameWithOwner'],
+            node['number']),
+        'diff_url': node['url'] + '.diff',
+        'created_at': node['createdAt'],
+        'updated_at': node['updatedAt'],
+        'base': {'ref': node['baseRefName']},
+        'user': {'login': author['login'], 'html_url': author['url']},
+        'comments': node['comments']['totalCount'],
+        'review_comments': sum(
+            review['comments']['totalCount']
+            for review in node['reviews']['nodes']),
+        'additions': node['additions'],
+        'deletions': node['deletions'],
+        'changed_files': node['changedFiles'],
+        'commits': node['commits']['totalCount'],
+        'labels': [{'name': label['name']} for label in node['labels']['nodes']],
+    }
+
+    files = [
+        FileStat(f['path'], f['additions'], f['deletions'])
+        for f in node['files']['nodes']
+    ]
+
+    return pr, files
@@ -1,5 +1,7 @@
 from dataclasses import dataclass
 import functools
+import re
+from typing import List, Union
 from unidiff import PatchSet
 
 HIGH_WEIGHTED_PATHS = (
@@ -22,71 +24,170 @@ HIGH_WEIGHTED_PATHS = (
     'Makefile',
 )
 
-@dataclass
-class PullRequest:
+# Matches any path under HIGH_WEIGHTED_PATHS in one go.
+HIGH_WEIGHTED_PATH_RE = re.compile(
+    '|'.join(re.escape(path) for path in HIGH_WEIGHTED_PATHS))
+
+def is_high_weighted(path):
     '''
-    This contains all of the information we care about when rendering pull
-    requests in the UI. In addition to the original PR, it contains fields like
-    weight, diff information, CI status, etc.
+    >>> is_high_weighted('lib/ansible/modules/ping.py')
+    True
+    >>> is_high_weighted('docs/docsite/rst/index.rst')
+    False
     '''
-    pr: dict
-    diff: PatchSet
+    return HIGH_WEIGHTED_PATH_RE.match(path) is not None
+
+@dataclass(frozen=True)
+class FileStat:
+    '''
+    Line counts for one file changed by a PR. This has the same attributes we
+    read from unidiff's PatchedFile, so a list of these can stand in for a
+    PatchSet when we don't have (or want) the whole diff.
+    '''
+    path: str
+    added: int
+    removed: int
+
+# The parts of a pull request API response that we actually use, for when we
+# save PRs to disk. Anything nested is trimmed to the keys listed with it.
+SLIM_PR_KEYS = {
+    'number': None,
+    'title': None,
+    'body': None,
+    'state': None,
+    'url': None,
+    'html_url': None,
+    'diff_url': None,
+    'created_at': None,
+    'updated_at': None,
+    'comments': None,
+    'review_comments': None,
+    'additions': None,
+    'deletions': None,
+    'changed_files': None,
+    'commits': None,
+    'user': ('login', 'html_url'),
+    'base': ('ref',),
+    'labels': ('name',),
+}
+
+def slim_pr(pr):
+    '''
+    Trim a pull request API response down to SLIM_PR_KEYS.
+
+    >>> slim_pr({'number': 1, 'node_id': 'x', 'labels': [{'name': 'docs',
+    ...     'color': 'fff'}]})
+    {'number': 1, 'labels': [{'name': 'docs'}]}
+    '''
+    out = {}
+    for key, nested in SLIM_PR_KEYS.items():
+        if key not in pr:
+            continue
+        value = pr[key]
+        if nested is not None and isinstance(value, dict):
+            value = {k: value.get(k) for k in nested}
+        elif nested is not None and isinstance(value, list):
+            value = [{k: v.get(k) for k in nested} for v in value]
+        out[key] = value
+    return out
+
+@dataclass(frozen=True)
+class RiskProfile:
+    '''
+    The points a PR scored for each risk factor, so that we can show why it
+    is (or isn't) risky without scoring it again.
+    '''
+    comments: int
+    review_comments: int
+    lines_changed: int
+    files_changed: int
+    commits: int
+    high_weighted: int
+
+    # Add 10 points to MAX_SCORE for each risk factor/metric added, even if
+    # the added metric is worth less than 10 because it's weighted less.
+    MAX_SCORE = 60
+
+    # The most points each factor can score, for display.
+    FACTOR_MAX = {
+        'comments': 10,
+        'review_comments': 10,
+        'lines_changed': 5,
+        'files_changed': 5,
+        'commits': 5,
+        'high_weighted': 10,
+    }
 
     @property
-    def risk(self):
-        '''Assign a risk score to the PR.'''
-        # Add 10 points to max_score for each risk factor/metric added, even if
-        # the added metric is worth less than 10 because it's weighted less.
-        max_score = 60
-        score = 0
+    def score(self):
+        return sum(self.factors().values()) / self.MAX_SCORE
 
+    def factors(self):
+        return {name: getattr(self, name) for name in self.FACTOR_MAX}
+
+    def explain(self):
+        '''
+        >>> RiskProfile(4, 1, 5, 1, 1, 0).explain()
+        'comments 4/10, review comments 1/10, lines changed 5/5, files changed 1/5, commits 1/5, high-weighted paths 0/10'
+        '''
+        labels = {'high_weighted': 'high-weighted paths'}
+        return ', '.join(
+            '{0} {1}/{2}'.format(
+                labels.get(name, name.replace('_', ' ')),
+                points,
+                self.FACTOR_MAX[name])
+            for name, points in self.factors().items())
+
+    @classmethod
+    def score_pr(cls, pr, files):
+        '''Score a PR given its API response and per-file line counts.'''
         # This is all arbitrary, we just need to roughly assign a score.
 
         # 1: How many comments are there on the PR?
-        comments = self.pr.get('comments', 0)
+        comments = pr.get('comments', 0)
         if comments > 5:
-            score += 10
+            comments_score = 10
         else:
-            score += comments * 2
+            comments_score = comments * 2
 
         # 2: How many review comments are there?
-        review_comments = self.pr.get('review_comments', 0)
+        review_comments = pr.get('review_comments', 0)
         if comments > 3:
-            score += 10
+            review_comments_score = 10
         elif comments == 3:
-            score += 8
+            review_comments_score = 8
         elif comments == 2:
-            score += 4
+            review_comments_score = 4
         else:
-            score += 1
+            review_comments_score = 1
 
         # 3: How many lines were added + removed?
         # This isn't out of 10, we intentionally weigh this less
-        lines_changed = abs(self.pr.get('additions', 0) + self.pr.get('deletions', 0))
+        lines_changed = abs(pr.get('additions', 0) + pr.get('deletions', 0))
         if lines_changed < 10:
-            score += 1
+            lines_changed_score = 1
         elif lines_changed < 25:
-            score += 3
+            lines_changed_score = 3
         else:
-            score += 5
+            lines_changed_score = 5
 
         # 4: How many files were changed?
         # This isn't out of 10, we intentionally weigh this less
-        files_changed = self.pr.get('changed_files', 0)
+        files_changed = pr.get('changed_files', 0)
         if files_changed < 3:
-            score += 1
+            files_changed_score = 1
         elif files_changed < 5:
-            score += 3
+            files_changed_score = 3
         else:
-            score += 5
+            files_changed_score = 5
 
         # 5: How many commits are in the PR?
         # This isn't out of 10, we intentionally weigh this less
-        commits = self.pr.get('commits', 0)
+        commits = pr.get('commits', 0)
         if commits < 3:
-            score += commits
+            commits_score = commits
         else:
-            score += 5
+            commits_score = 5
 
         # 6: How many high-weighted files were changed?
         # We only handle high-weighted here. Everything else is handled by the
@@ -94,22 +195,63 @@ class PullRequest:
         # PR).
         hw_files_changed = 0
         hw_lines_changed = 0
-        for changed_file in self.diff:
-            for path in HIGH_WEIGHTED_PATHS:
-                if changed_file.path.startswith(path):
-                    hw_files_changed += 1
-                    hw_lines_changed += changed_file.added + changed_file.removed
+        for changed_file in files:
+            if is_high_weighted(changed_file.path):
+                hw_files_changed += 1
+                hw_lines_changed += changed_file.added + changed_file.removed
         if hw_files_changed > 5 and hw_lines_changed > 25:
-            score += 10
+            high_weighted_score = 10
         elif hw_files_changed > 2 and hw_lines_changed > 10:
-            score += 7
+            high_weighted_score = 7
         elif hw_files_changed > 0:
             if hw_lines_changed > 20:
-                score += 5
+                high_weighted_score = 5
             else:
-                score += 3
+                high_weighted_score = 3
+        else:
+            high_weighted_score = 0
+
+        return cls(
+            comments_score,
+            review_comments_score,
+            lines_changed_score,
+            files_changed_score,
+            commits_score,
+            high_weighted_score)
+
+@dataclass
+class PullRequest:
+    '''
+    This contains all of the information we care about when rendering pull
+    requests in the UI. In addition to the original PR, it contains fields like
+    weight, diff information, CI status, etc.
+    '''
+    pr: dict
+    # Per-file line counts. A PatchSet also works here, but we only fetch the
+    # full diff when something actually needs it.
+    files: Union[List[FileStat], PatchSet]
 
-        return score / max_score
+    @functools.cached_property
+    def risk_profile(self):
+        '''
+        Score the PR once, keeping the points for each factor. This is
+        recomputed only if ``pr`` or ``files`` is replaced; call
+        invalidate_risk() after changing either in place.
+        '''
+        return RiskProfile.score_pr(self.pr, self.files)
+
+    @property
+    def risk(self):
+        '''Assign a risk score to the PR.'''
+        return self.risk_profile.score
+
+    def invalidate_risk(self):
+        self.__dict__.pop('risk_profile', None)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in ('pr', 'files'):
+            self.invalidate_risk()
 
     def relative_risk(self, max_risk):
         '''
@@ -118,6 +260,17 @@ class PullRequest:
         '''
         return (self.risk / max_risk) * 100
 
+    def to_dict(self):
+        '''A compact, JSON-friendly form of the PR. See from_dict().'''
+        return {
+            'pr': slim_pr(self.pr),
+            'files': [[f.path, f.added, f.removed] for f in self.files],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['pr'], [FileStat(*f) for f in d['files']])
+
     @property
     def number(self):
         if 'number' not in self.pr:
@@ -130,11 +283,11 @@ class PullRequest:
     def is_missing_changelog(self):
         needs_changelog = False
 
-        for p in self.diff:
+        for p in self.files:
             if p.path.startswith('changelogs/fragments/'):
                 return False
 
-            if p.path.startswith(HIGH_WEIGHTED_PATHS):
+            if is_high_weighted(p.path):
                 needs_changelog = True
 
         return needs_changelog
@@ -142,7 +295,7 @@ class PullRequest:
     @property
     def is_docs(self):
         labels = [x['name'] for x in self.pr.get('labels', [])]
-        if all(x.path.startswith('docs/docsite') for x in self.diff):
+        if all(x.path.startswith('docs/docsite') for x in self.files):
             if 'docs' in labels:
                 return True
         return False
@@ -155,3 +308,17 @@ class PullRequest:
 @dataclass
 class Backport(PullRequest):
     original: PullRequest
+
+    def to_dict(self):
+        d = super().to_dict()
+        d['original'] = None if self.original is None else \
+            self.original.to_dict()
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        original = d.get('original')
+        return cls(
+            d['pr'],
+            [FileStat(*f) for f in d['files']],
+            None if original is None else PullRequest.from_dict(original))
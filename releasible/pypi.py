@@ -1,14 +1,23 @@
 import arrow
+import asyncio
+import bisect
 from dataclasses import dataclass
 from enum import Enum
+from json import loads
+import logging
 import packaging.version
-import requests
+import time
 from typing import Optional
+from releasible.cache import CachedResponse
+from releasible.trace import RequestRecord, current_phase
+
+log = logging.getLogger(__name__)
 
 class Stage(Enum):
     GENERAL_AVAILABILITY = 1
     BETA = 2
     RELEASE_CANDIDATE = 3
+    ALPHA = 4
 
     @staticmethod
     def from_version(version):
@@ -17,12 +26,16 @@ class Stage(Enum):
             if pre is None:
                 return Stage.GENERAL_AVAILABILITY
             else:
-                if pre[0] == 'b':
+                if pre[0] == 'a':
+                    return Stage.ALPHA
+                elif pre[0] == 'b':
                     return Stage.BETA
                 elif pre[0] == 'rc':
                     return Stage.RELEASE_CANDIDATE
         elif isinstance(version, str):
-            if 'b' in version:
+            if 'a' in version:
+                return Stage.ALPHA
+            elif 'b' in version:
                 return Stage.BETA
             elif 'rc' in version:
                 return Stage.RELEASE_CANDIDATE
@@ -44,6 +57,25 @@ class Release:
     def __eq__(self, other):
         return self.version == other.version
 
+    def to_dict(self):
+        '''A JSON-friendly form of the release. See from_dict().'''
+        return {
+            'product': self.product,
+            'version': str(self.version),
+            'is_published': self.is_published,
+            'stage': self.stage.name,
+            'date': None if self.date is None else self.date.isoformat(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            d['product'],
+            packaging.version.Version(d['version']),
+            d['is_published'],
+            Stage[d['stage']],
+            None if d['date'] is None else arrow.get(d['date']))
+
     def guess_next_version(self):
         public = self.version.public
         if self.stage == Stage.RELEASE_CANDIDATE:
@@ -51,9 +83,9 @@ class Release:
             # There's not much to do, we're going rc -> ga
             public = public.split('rc')[0]
             return packaging.version.parse(public)
-        elif self.stage == Stage.BETA:
+        elif self.stage in (Stage.ALPHA, Stage.BETA):
             # Impossible to know if it's likely to be beta -> rc or
-            # beta -> beta.
+            # beta -> beta (or alpha -> beta, alpha -> alpha).
             raise Exception('We do not currently try to guess betas')
         else:
             components = [int(x) for x in public.split('.')]
@@ -87,37 +119,152 @@ class Release:
             new_date)
 
 class PyPI:
-    def __init__(self, pkg):
-        url = 'https://pypi.python.org/pypi/{0}/json'.format(pkg)
-        r = requests.get(url)
-        r.raise_for_status()
-        self.json = r.json()
+    '''
+    The releases of one package on PyPI. The release list is parsed and
+    sorted once, when this is made, so that latest() is a bisect rather than
+    a pass over every release the package ever had.
+    '''
+    def __init__(self, pkg, json):
         self.pkg = pkg
 
-    def latest(self, version):
-        versions = []
-        # This could be more efficient, we construct a lot of objects for no
-        # reason here
-        for release, details in self.json['releases'].items():
-            if not details or details[0]['yanked']:
+        # version -> upload time of its first file
+        self.uploads = {}
+        yanked = []
+        for release, details in json['releases'].items():
+            if not details:
+                continue
+            try:
+                version = packaging.version.Version(release)
+            except packaging.version.InvalidVersion:
+                continue
+            if details[0]['yanked']:
                 # Skip any yanked releases, we don't count them
+                yanked.append(version)
                 continue
+            self.uploads[version] = details[0]['upload_time_iso_8601']
+
+        self.versions = sorted(self.uploads)
+        self.yanked = sorted(yanked)
 
-            if release.startswith(version):
-                versions.append(packaging.version.parse(release))
+    def release(self, version):
+        return Release(
+            self.pkg,
+            version,
+            True,
+            Stage.from_version(version),
+            arrow.get(self.uploads[version]))
+
+    def newest(self, prereleases=False):
+        '''Return the newest Release of the package, or None.'''
+        for version in reversed(self.versions):
+            if prereleases or not version.is_prerelease:
+                return self.release(version)
 
-        versions = sorted(versions)
+    def latest(self, version):
+        '''
+        Return the newest Release in a series (like '2.10', or '2.10.3' for
+        that release's betas and release candidates), or None if there isn't
+        one.
+        '''
+        series = packaging.version.Version(version).release
 
-        if not versions:
+        # The first version past the series, e.g. 2.11.dev0 for 2.10, which
+        # sorts before any 2.11 pre-release.
+        upper = '.'.join(str(n) for n in series[:-1] + (series[-1] + 1,))
+        idx = bisect.bisect_left(
+            self.versions,
+            packaging.version.Version(upper + '.dev0'))
+
+        if idx == 0:
+            return
+        latest = self.versions[idx - 1]
+        if latest.release[:len(series)] != series:
             return
 
-        latest = versions[-1]
-        details = self.json['releases'][latest.public][0]
-        r = Release(
-            self.pkg,
-            latest,
-            True,
-            Stage.from_version(latest),
-            arrow.get(details['upload_time_iso_8601']))
+        return self.release(latest)
+
+class PyPIClient:
+    '''
+    Fetches package metadata from PyPI over a shared aiohttp session. Each
+    package is fetched and parsed at most once per client, however many
+    times it's asked for, and revalidated against ``cache`` (a
+    releasible.cache.ResponseCache) if there is one. At most
+    ``max_concurrency`` requests are sent at once. Requests are recorded in
+    ``tracer`` (a releasible.trace.Tracer) if given one.
+    '''
+    def __init__(self, aio_session, cache=None, max_concurrency=10,
+                 tracer=None):
+        self.aio_session = aio_session
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.tracer = tracer
+        # package name -> task resolving to its PyPI
+        self.fetched = {}
+
+    async def get(self, endpoint):
+        log.info('GET %s', endpoint)
+        headers = {}
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(endpoint)
+            if cached is not None:
+                headers.update(cached.conditional_headers())
+
+        record = RequestRecord(endpoint, phase=current_phase.get())
+        try:
+            async with self.semaphore:
+                record.start = time.monotonic()
+                async with self.aio_session.get(
+                        endpoint, headers=headers) as resp:
+                    record.status = resp.status
+                    if resp.status == 304 and cached is not None:
+                        record.cache = 'hit'
+                        return loads(cached.body)
+                    if resp.status != 200:
+                        raise Exception(
+                            '{0} got status {1}: {2}'.format(
+                                endpoint,
+                                resp.status,
+                                await resp.text()))
+                    raw = await resp.read()
+                    record.bytes = len(raw)
+                    body = raw.decode(resp.get_encoding())
+                    if self.cache is not None:
+                        record.cache = 'miss' if cached is None else 'stale'
+
+                    etag = resp.headers.get('etag')
+                    last_modified = resp.headers.get('last-modified')
+                    if self.cache is not None and (etag or last_modified):
+                        self.cache.put(
+                            endpoint,
+                            CachedResponse(body, etag, last_modified))
+        finally:
+            if self.tracer is not None:
+                self.tracer.finish(record)
+
+        return loads(body)
+
+    async def package(self, pkg) -> PyPI:
+        task = self.fetched.get(pkg)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_package(pkg))
+            self.fetched[pkg] = task
+        return await asyncio.shield(task)
+
+    async def packages(self, pkgs):
+        '''
+        Fetch several packages at once, at most max_concurrency at a time.
+        Returns a dict of package name to PyPI.
+        '''
+        return dict(zip(
+            pkgs,
+            await asyncio.gather(*[self.package(pkg) for pkg in pkgs])))
 
-        return r
+    async def _fetch_package(self, pkg):
+        try:
+            json = await self.get('https://pypi.org/pypi/{0}/json'.format(pkg))
+        except BaseException:
+            # Let a later call try again.
+            del self.fetched[pkg]
+            raise
+        return PyPI(pkg, json)
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+import functools
+import re
+from typing import Tuple, Union
+
+PULL_URL_RE = re.compile(r'(?P<user>\S+)/(?P<repo>\S+)#(?P<ticket>\d+)')
+PULL_HTTP_URL_RE = re.compile(r'https?://(?:www\.|)github\.com/(?P<user>\S+)/(?P<repo>\S+)/pull/(?P<ticket>\d+)')
+COMMIT_HTTP_URL_RE = re.compile(r'https?://(?:www\.|)github\.com/(?P<user>\S+)/(?P<repo>\S+)/commit/(?P<hash>\w+)')
+PULL_BACKPORT_IN_TITLE = re.compile(r'\((?:backport of |)#?(?P<ticket>\d+)\)', re.I)
+PULL_CHERRY_PICKED_FROM = re.compile(r'\(?cherry(?:\-| )picked from(?: commit|) (?P<hash>\w+)(?:\)|\.|$)')
+TICKET_NUMBER = re.compile(r'(?:^|\s)#(?P<ticket>\d+)')
+
+# All of the above that can turn up in a body, as one pattern, so that a body
+# is scanned once rather than once per pattern per line. Alternatives which
+# start at the same place are tried in the order they're listed here.
+BODY_REFERENCE = re.compile(
+    r'(?P<cherrypick>^\(?cherry(?:\-| )picked from(?: commit|) (?P<cherrypick_hash>\w+)(?:\)|\.|$))'
+    r'|(?P<commit_url>https?://(?:www\.|)github\.com/\S+/\S+/commit/(?P<commit_hash>\w+))'
+    r'|(?P<pull_url>https?://(?:www\.|)github\.com/(?P<pull_url_user>\S+)/(?P<pull_url_repo>\S+)/pull/(?P<pull_url_ticket>\d+))'
+    r'|(?:^|(?<=\s))#(?P<ticket>\d+)'
+    r'|(?P<pull>(?P<pull_user>\S+)/(?P<pull_repo>\S+)#(?P<pull_ticket>\d+))',
+    re.M)
+
+@dataclass(frozen=True)
+class CommitRef:
+    sha: str
+
+    @property
+    def key(self):
+        return ('commit', self.sha.lower())
+
+@dataclass(frozen=True)
+class PullRef:
+    '''A PR referred to by URL or as user/repo#number.'''
+    user: str
+    repo: str
+    number: int
+
+    @property
+    def key(self):
+        # Owners and repos are case-insensitive on GitHub.
+        return ('pull', self.user.lower(), self.repo.lower(), self.number)
+
+    def __str__(self):
+        return '{0}/{1}#{2}'.format(self.user, self.repo, self.number)
+
+@dataclass(frozen=True)
+class TicketRef:
+    '''A bare #number, which is a PR or issue in ansible/ansible.'''
+    number: int
+
+    @property
+    def key(self):
+        return ('pull', 'ansible', 'ansible', self.number)
+
+    def __str__(self):
+        return '#{0}'.format(self.number)
+
+Reference = Union[CommitRef, PullRef, TicketRef]
+
+@functools.lru_cache(maxsize=4096)
+def extract_references(title, body) -> Tuple[Reference, ...]:
+    '''
+    Find every reference to another PR or commit in a PR's title and body,
+    most likely to be the original first, without duplicates.
+
+    The title's "(#nnnn)" or "(backport of #nnnn)" comes first. Then, line by
+    line through the body, a line gives either its cherry-pick line, or else
+    its first link to a commit, or else all of its bare #nnnn, then links to
+    PRs, then user/repo#nnnn.
+
+    Results are memoized on the title and body, so looking at the same PR
+    again (from another branch, or a later build in the same process) is
+    free.
+
+    >>> extract_references(
+    ...     'Fix things (#123)',
+    ...     'Fixes #45 and ansible/ansible#123\\n'
+    ...     '(cherry picked from commit 0123abc)\\n'
+    ...     'See https://github.com/foo/bar/pull/6')
+    (TicketRef(number=123), TicketRef(number=45), CommitRef(sha='0123abc'), PullRef(user='foo', repo='bar', number=6))
+    '''
+    found = []
+
+    title_search = PULL_BACKPORT_IN_TITLE.search(title)
+    if title_search:
+        found.append(TicketRef(int(title_search.group('ticket'))))
+
+    # line start -> (cherry-pick, commit links, tickets, PR links, user/repo#n)
+    lines = {}
+    for match in BODY_REFERENCE.finditer(body):
+        line = lines.setdefault(
+            body.rfind('\n', 0, match.start()),
+            ([], [], [], [], []))
+        if match.group('cherrypick'):
+            line[0].append(CommitRef(match.group('cherrypick_hash')))
+        elif match.group('commit_url'):
+            line[1].append(CommitRef(match.group('commit_hash')))
+        elif match.group('pull_url'):
+            line[3].append(PullRef(
+                match.group('pull_url_user'),
+                match.group('pull_url_repo'),
+                int(match.group('pull_url_ticket'))))
+        elif match.group('ticket'):
+            line[2].append(TicketRef(int(match.group('ticket'))))
+        else:
+            line[4].append(PullRef(
+                match.group('pull_user'),
+                match.group('pull_repo'),
+                int(match.group('pull_ticket'))))
+
+    for start in sorted(lines):
+        cherrypicks, commits, tickets, pull_urls, pulls = lines[start]
+        if cherrypicks:
+            found.append(cherrypicks[0])
+        elif commits:
+            found.append(commits[0])
+        else:
+            found.extend(tickets + pull_urls + pulls)
+
+    seen = set()
+    out = []
+    for ref in found:
+        if ref.key not in seen:
+            seen.add(ref.key)
+            out.append(ref)
+    return tuple(out)
@@ -0,0 +1,90 @@
+import datetime
+import gzip
+import json
+import os
+import os.path
+import packaging.version
+from releasible.model.pullrequest import Backport, PullRequest
+from releasible.pypi import Release
+
+# Bump this whenever what's written changes in a way older code can't read.
+SNAPSHOT_VERSION = 1
+
+# What can turn up in a page context besides JSON's own types, by the name
+# it's tagged with in a snapshot. Each has to_dict() and from_dict().
+TYPES = {
+    'Backport': Backport,
+    'PullRequest': PullRequest,
+    'Release': Release,
+}
+
+class SnapshotError(Exception):
+    pass
+
+def encode(value):
+    '''
+    Turn a page context (or anything in one) into JSON-friendly values.
+    Objects are tagged with their type so that decode() can bring them back.
+    Tuples come back as lists, which templates unpack all the same.
+
+    >>> encode({'yanked': [packaging.version.Version('1.0')], 'n': (1, None)})
+    {'yanked': [{'__type__': 'Version', 'version': '1.0'}], 'n': [1, None]}
+    '''
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, packaging.version.Version):
+        return {'__type__': 'Version', 'version': str(value)}
+    name = type(value).__name__
+    if name in TYPES:
+        return dict(value.to_dict(), __type__=name)
+    return value
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    name = value.get('__type__')
+    if name is None:
+        return {key: decode(item) for key, item in value.items()}
+    if name == 'Version':
+        return packaging.version.Version(value['version'])
+    if name not in TYPES:
+        raise SnapshotError('Unknown type in snapshot: {0}'.format(name))
+    return TYPES[name].from_dict(value)
+
+def dump(contexts, path):
+    '''
+    Write every page's context (page name -> context) to a gzipped JSON
+    snapshot at ``path``. The file is replaced in one go, so a failed
+    write never leaves half a snapshot behind.
+    '''
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'contexts': encode(contexts),
+    }
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+def load(path):
+    '''Read the page contexts back from a snapshot written by dump().'''
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        snapshot = json.load(f)
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError(
+            '{0} is a version {1} snapshot, we read version {2}. Fetch '
+            'again to replace it.'.format(
+                path,
+                snapshot.get('version'),
+                SNAPSHOT_VERSION))
+    return decode(snapshot['contexts'])
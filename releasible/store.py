@@ -0,0 +1,112 @@
+import json
+import os
+import os.path
+import sqlite3
+import time
+from typing import List, Optional
+from releasible.model.pullrequest import PullRequest
+
+class BackportStore:
+    '''
+    Remembers the PRs we fetched and the originals we found for each
+    backport, keyed on the PR's API URL and its ``updated_at``. Anything
+    about a PR which hasn't been updated since the last build can be loaded
+    from here instead of asking GitHub again.
+    '''
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS prs ('
+            'url TEXT PRIMARY KEY, '
+            'updated_at TEXT, '
+            'data TEXT NOT NULL)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS originals ('
+            'url TEXT PRIMARY KEY, '
+            'updated_at TEXT, '
+            'originals TEXT NOT NULL)')
+        # References which turned out not to be PRs (mostly issues), and when
+        # we found that out.
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS not_prs ('
+            'url TEXT PRIMARY KEY, '
+            'checked_at REAL NOT NULL)')
+
+    def get(self, url, updated_at=None) -> Optional[PullRequest]:
+        '''
+        Load a stored PR. If ``updated_at`` is given, only return it if it
+        hasn't been updated since we stored it.
+        '''
+        row = self.db.execute(
+            'SELECT updated_at, data FROM prs WHERE url = ?',
+            (url.lower(),)).fetchone()
+        if row is None:
+            return None
+        if updated_at is not None and row[0] != updated_at:
+            return None
+        return PullRequest.from_dict(json.loads(row[1]))
+
+    def put(self, pr: PullRequest):
+        self.db.execute(
+            'INSERT OR REPLACE INTO prs (url, updated_at, data) '
+            'VALUES (?, ?, ?)',
+            (pr.pr['url'].lower(),
+             pr.pr.get('updated_at'),
+             json.dumps(pr.to_dict())))
+
+    def get_originals(self, pr: PullRequest, limit=None) -> Optional[List[str]]:
+        '''
+        Return the API URLs of the originals found for a backport, if the
+        backport hasn't been updated since we found them. If only the first
+        few originals were looked for last time, they're only returned to
+        callers asking for no more than that many.
+        '''
+        row = self.db.execute(
+            'SELECT updated_at, originals FROM originals WHERE url = ?',
+            (pr.pr['url'].lower(),)).fetchone()
+        if row is None or row[0] != pr.pr.get('updated_at'):
+            return None
+
+        originals = json.loads(row[1])
+        if isinstance(originals, dict):
+            if limit is None or limit > originals['limit']:
+                return None
+            originals = originals['originals']
+        return originals[:limit]
+
+    def put_originals(self, pr: PullRequest, originals: List[PullRequest],
+                      limit=None):
+        '''
+        Remember the originals found for a backport. ``limit`` says that the
+        search stopped after finding that many, so there might be more.
+        '''
+        urls = [original.pr['url'] for original in originals]
+        if limit is not None:
+            urls = {'originals': urls, 'limit': limit}
+        self.db.execute(
+            'INSERT OR REPLACE INTO originals (url, updated_at, originals) '
+            'VALUES (?, ?, ?)',
+            (pr.pr['url'].lower(),
+             pr.pr.get('updated_at'),
+             json.dumps(urls)))
+
+    def is_not_pr(self, url, ttl) -> bool:
+        '''
+        Whether ``url`` (a PR's API URL) was found not to be a PR in the last
+        ``ttl`` seconds.
+        '''
+        row = self.db.execute(
+            'SELECT checked_at FROM not_prs WHERE url = ?',
+            (url.lower(),)).fetchone()
+        return row is not None and row[0] > time.time() - ttl
+
+    def put_not_pr(self, url):
+        self.db.execute(
+            'INSERT OR REPLACE INTO not_prs (url, checked_at) VALUES (?, ?)',
+            (url.lower(), time.time()))
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,195 @@
+import contextlib
+import contextvars
+from dataclasses import asdict, dataclass, field
+import functools
+import re
+import time
+from typing import List, Optional
+
+# What the code making a request is doing, e.g. 'search' or 'get_pr'. Set with
+# phase(); asyncio tasks inherit it from whoever created them.
+current_phase = contextvars.ContextVar('current_phase', default=None)
+
+@contextlib.contextmanager
+def phase(name):
+    '''Attribute requests made inside this block to ``name``.'''
+    token = current_phase.set(name)
+    try:
+        yield
+    finally:
+        current_phase.reset(token)
+
+def in_phase(name):
+    '''Decorate a coroutine function to run it in phase(name).'''
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with phase(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+ENDPOINT_PATTERNS = [
+    (re.compile(r'/repos/[^/]+/[^/]+/'), '/repos/:owner/:repo/'),
+    (re.compile(r'^https://github\.com/[^/]+/[^/]+/'), 'https://github.com/:owner/:repo/'),
+    (re.compile(r'/raw/[^/]+/[^/]+/'), '/raw/:owner/:repo/'),
+    (re.compile(r'^https://pypi\.org/pypi/[^/]+/'), 'https://pypi.org/pypi/:package/'),
+    (re.compile(r'/[0-9a-f]{40}(?=/|$)'), '/:sha'),
+    (re.compile(r'/\d+(?=/|\.|$)'), '/:number'),
+]
+
+def endpoint_template(endpoint):
+    '''
+    Reduce a URL to the kind of request it is, for grouping requests by.
+
+    >>> endpoint_template('https://api.github.com/repos/ansible/ansible/pulls/123?per_page=1')
+    'https://api.github.com/repos/:owner/:repo/pulls/:number'
+    >>> endpoint_template('https://github.com/ansible/ansible/pull/123.diff')
+    'https://github.com/:owner/:repo/pull/:number.diff'
+    >>> endpoint_template('https://pypi.org/pypi/ansible-core/json')
+    'https://pypi.org/pypi/:package/json'
+    '''
+    template = endpoint.split('?', 1)[0]
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        template = pattern.sub(replacement, template)
+    return template
+
+@dataclass
+class RequestRecord:
+    '''What happened to one request. Filled in as the request goes along.'''
+    endpoint: str
+    method: str = 'GET'
+    phase: Optional[str] = None
+    start: float = 0.0
+    duration: float = 0.0
+    status: Optional[int] = None
+    bytes: int = 0
+    # 'hit' (revalidated, 304), 'miss' (not cached), 'stale' (cached but
+    # changed), or None if there's no cache.
+    cache: Optional[str] = None
+    remaining: Optional[int] = None
+    retries: int = 0
+
+    @property
+    def template(self):
+        return endpoint_template(self.endpoint)
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start: float
+    duration: float = 0.0
+
+@dataclass
+class Tracer:
+    '''
+    Collects a RequestRecord for every request and a Span for every block of
+    work wrapped in span(), to be summarized or exported as a Chrome trace
+    (chrome://tracing, or https://ui.perfetto.dev).
+    '''
+    requests: List[RequestRecord] = field(default_factory=list)
+    spans: List[Span] = field(default_factory=list)
+    origin: float = field(default_factory=time.monotonic)
+
+    def finish(self, record):
+        record.duration = time.monotonic() - record.start
+        self.requests.append(record)
+
+    @contextlib.contextmanager
+    def span(self, name, category='build'):
+        span = Span(name, category, time.monotonic())
+        try:
+            yield span
+        finally:
+            span.duration = time.monotonic() - span.start
+            self.spans.append(span)
+
+    def summary(self):
+        '''
+        One row per kind of request (see endpoint_template()): how many
+        there were, how many failed or were answered from the cache, their
+        p50 and p95 latency in seconds and how many bytes they returned.
+        '''
+        groups = {}
+        for record in self.requests:
+            groups.setdefault(record.template, []).append(record)
+
+        rows = []
+        for template, records in groups.items():
+            latencies = sorted(record.duration for record in records)
+            rows.append({
+                'endpoint': template,
+                'count': len(records),
+                'errors': sum(
+                    1 for record in records
+                    if record.status is None or record.status >= 400),
+                'cache_hits': sum(
+                    1 for record in records if record.cache == 'hit'),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'bytes': sum(record.bytes for record in records),
+            })
+        rows.sort(key=lambda row: -row['count'])
+        return rows
+
+    def format_summary(self):
+        lines = ['{0:>6} {1:>6} {2:>6} {3:>8} {4:>8} {5:>10}  {6}'.format(
+            'count', 'errors', 'cached', 'p50', 'p95', 'bytes', 'endpoint')]
+        for row in self.summary():
+            lines.append(
+                '{count:>6} {errors:>6} {cache_hits:>6} {p50:>8.3f} '
+                '{p95:>8.3f} {bytes:>10}  {endpoint}'.format(**row))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        '''
+        The spans and requests in Chrome's trace event format. Everything is
+        an async event, since spans and requests overlap freely.
+        '''
+        events = []
+
+        def add(ident, name, category, start, duration, args):
+            ts = (start - self.origin) * 1e6
+            common = {
+                'name': name,
+                'cat': category,
+                'id': ident,
+                'pid': 1,
+                'tid': 1,
+            }
+            events.append(dict(common, ph='b', ts=ts, args=args))
+            events.append(dict(common, ph='e', ts=ts + duration * 1e6))
+
+        for ident, span in enumerate(self.spans):
+            add(
+                'span-{0}'.format(ident),
+                span.name,
+                span.category,
+                span.start,
+                span.duration,
+                {})
+        for ident, record in enumerate(self.requests):
+            add(
+                'request-{0}'.format(ident),
+                record.template,
+                record.phase or 'request',
+                record.start,
+                record.duration,
+                asdict(record))
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def percentile(values, pct):
+    '''
+    The ``pct``th percentile of sorted ``values`` (nearest rank).
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 95)
+    4
+    '''
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
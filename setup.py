@@ -13,7 +13,6 @@ setup(
         'arrow',
         'asyncio',
         'gql == 3.0.0a5',
-        'requests',
         'staticjinja',
         'unidiff',
     ],
@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+'''
+A stand-in for the parts of GitHub that releasible talks to, serving a made
+up ansible/ansible with as many backports as we like, so that the backport
+pipeline can be load tested without a token (or burning its rate limit).
+
+    python test/fakegithub.py [--backports N] [--latency SECONDS] ...
+
+Point a GitHubAPICall (or BackportFinder) at it with
+server='http://localhost:8000', or a build with
+RELEASIBLE_GITHUB_SERVER=http://localhost:8000.
+
+It serves search/issues, search/commits, pulls (and their files and diffs),
+commits/{sha}/pulls, actions runs and jobs, and the GraphQL queries
+BackportFinder makes. Every response is held back by ``latency`` seconds
+(plus up to ``jitter``), and the core, search and graphql rate limits are
+enforced and reported with GitHub's X-RateLimit-* headers. Responses have
+ETags, and conditional requests get a 304 which, like on GitHub, doesn't
+count against the rate limit. URLs it hands out (in Link headers and
+responses) are GitHub's, which GitHubAPICall.route() sends back here.
+'''
+
+import argparse
+import asyncio
+import collections
+import contextlib
+from dataclasses import dataclass, field
+import datetime
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Dict, List, Set
+
+from aiohttp import web
+
+REPO = 'ansible/ansible'
+API = 'https://api.github.com'
+WEB = 'https://github.com'
+
+EPOCH = datetime.datetime(2021, 1, 1)
+
+BODY_STYLES = {
+    # Backport of #nnnn, which is the original PR.
+    'ticket': '##### SUMMARY\nBackport of #{original}\n\n'
+              '##### ISSUE TYPE\n- Bugfix Pull Request\n',
+    # Only the commit it was cherry-picked from, which is looked up with a
+    # commit search.
+    'cherry-pick': '##### SUMMARY\n'
+                   '(cherry picked from commit {sha})\n',
+    # Mentions an issue before the original.
+    'issue': '##### SUMMARY\nFixes #{issue}\n\nBackport of #{original}\n',
+}
+
+def timestamp(minutes):
+    return (EPOCH + datetime.timedelta(minutes=minutes)).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+
+def commit_sha(number):
+    return hashlib.sha1(str(number).encode('ascii')).hexdigest()
+
+@dataclass
+class FakeRepo:
+    '''
+    A made up ansible/ansible: PR number -> pull request response, diff and
+    files, the PR each merge commit came from, and which numbers are issues.
+    '''
+    prs: Dict[int, dict] = field(default_factory=dict)
+    files: Dict[int, List[dict]] = field(default_factory=dict)
+    commits: Dict[str, int] = field(default_factory=dict)
+    issues: Set[int] = field(default_factory=set)
+
+    def add_pr(self, number, title, body, base, files, merged=False,
+               labels=()):
+        created = timestamp(number - 70000)
+        self.prs[number] = {
+            'url': '{0}/repos/{1}/pulls/{2}'.format(API, REPO, number),
+            'html_url': '{0}/{1}/pull/{2}'.format(WEB, REPO, number),
+            'diff_url': '{0}/{1}/pull/{2}.diff'.format(WEB, REPO, number),
+            'number': number,
+            'state': 'closed' if merged else 'open',
+            'title': title,
+            'body': body,
+            'user': {
+                'login': 'user{0}'.format(number % 50),
+                'html_url': '{0}/user{1}'.format(WEB, number % 50),
+            },
+            'created_at': created,
+            'updated_at': created,
+            'merged_at': created if merged else None,
+            'merge_commit_sha': commit_sha(number),
+            'base': {'ref': base},
+            'labels': [{'name': label} for label in labels],
+            'comments': number % 7,
+            'review_comments': number % 11,
+            'additions': sum(f['additions'] for f in files),
+            'deletions': sum(f['deletions'] for f in files),
+            'changed_files': len(files),
+            'commits': 1 + number % 3,
+        }
+        self.files[number] = files
+        if merged:
+            self.commits[commit_sha(number)] = number
+
+    def diff(self, number):
+        out = []
+        for f in self.files[number]:
+            out.append('diff --git a/{0} b/{0}\n'.format(f['filename']))
+            out.append('--- a/{0}\n+++ b/{0}\n'.format(f['filename']))
+            out.append('@@ -1,{0} +1,{1} @@\n'.format(
+                f['deletions'],
+                f['additions']))
+            out.extend('-old line\n' for _ in range(f['deletions']))
+            out.extend('+new line\n' for _ in range(f['additions']))
+        return ''.join(out)
+
+def make_repo(versions=('2.9', '2.10', '2.11'), backports=100, seed=0,
+              styles=('ticket', 'ticket', 'cherry-pick', 'issue')):
+    '''
+    Make a FakeRepo with ``backports`` PRs merged to devel, each of them
+    backported (by an open PR labelled "backport") to every one of
+    ``versions``. Each backport's body points at its original in a style
+    picked from ``styles`` (see BODY_STYLES).
+    '''
+    rng = random.Random(seed)
+    repo = FakeRepo()
+    number = 70000
+
+    for n in range(backports):
+        files = [
+            {
+                'filename': 'lib/ansible/module_{0}.py'.format(
+                    rng.randrange(1000)),
+                'additions': rng.randint(1, 40),
+                'deletions': rng.randint(1, 20),
+            }
+            for _ in range(rng.randint(1, 5))
+        ]
+        title = 'Fix thing {0}'.format(n)
+
+        original = number
+        repo.add_pr(original, title, '', 'devel', files, merged=True)
+        issue = original + 1
+        repo.issues.add(issue)
+        number += 2
+
+        for version in versions:
+            style = rng.choice(styles)
+            body = BODY_STYLES[style].format(
+                original=original,
+                sha=commit_sha(original),
+                issue=issue)
+            backport_title = '[stable-{0}] {1}'.format(version, title)
+            if style != 'cherry-pick':
+                backport_title += ' (#{0})'.format(original)
+            repo.add_pr(
+                number,
+                backport_title,
+                body,
+                'stable-{0}'.format(version),
+                files,
+                labels=('backport',))
+            number += 1
+
+    return repo
+
+def search_terms(query):
+    '''
+    Split a search query into (qualifier, value, negated) terms.
+
+    >>> search_terms('is:pr -label:on_hold base:stable-2.9')
+    [('is', 'pr', False), ('label', 'on_hold', True), ('base', 'stable-2.9', False)]
+    '''
+    terms = []
+    for term in query.split():
+        negated = term.startswith('-')
+        qualifier, _, value = term.lstrip('-').partition(':')
+        terms.append((qualifier, value, negated))
+    return terms
+
+def matches(pr, terms):
+    labels = {label['name'] for label in pr['labels']}
+    for qualifier, value, negated in terms:
+        if qualifier == 'is' and value in ('open', 'closed'):
+            found = pr['state'] == value
+        elif qualifier == 'label':
+            found = value in labels
+        elif qualifier == 'base':
+            found = pr['base']['ref'] == value
+        elif qualifier == 'repo':
+            found = value.lower() == REPO
+        else:
+            # is:pr, sort:..., anything else we don't model.
+            continue
+        if found == negated:
+            return False
+    return True
+
+# One alias in BackportFinder.classify_pr_references()'s query.
+CLASSIFY_FIELD = re.compile(
+    r'(?P<repo_alias>\w+): repository\(owner: (?P<owner>"[^"]*"), '
+    r'name: (?P<name>"[^"]*")\)'
+    r'|(?P<alias>\w+): issueOrPullRequest\(number: (?P<number>\d+)\)')
+
+class FakeGitHub:
+    '''
+    The aiohttp application serving a FakeRepo. Keeps count of the requests
+    it served per route, and how many were rate limited or not modified.
+    '''
+    def __init__(self, repo, latency=0.0, jitter=0.0, rate_limit=5000,
+                 search_rate_limit=30, graphql_rate_limit=5000,
+                 rate_limit_window=3600, jobs=50, seed=0):
+        self.repo = repo
+        self.latency = latency
+        self.jitter = jitter
+        self.window = rate_limit_window
+        self.jobs = jobs
+        self.rng = random.Random(seed)
+        self.rate_limits = {
+            'core': rate_limit,
+            'search': search_rate_limit,
+            'graphql': graphql_rate_limit,
+        }
+        # resource -> [remaining, reset as a unix timestamp]
+        self.limits = {}
+        self.served = collections.Counter()
+        self.not_modified = 0
+        self.rate_limited = 0
+
+        # Newest first, like search results sorted by creation date.
+        self.by_created = sorted(
+            repo.prs.values(),
+            key=lambda pr: pr['created_at'],
+            reverse=True)
+
+        @web.middleware
+        async def middleware(request, handler):
+            return await self.respond(request, handler)
+
+        self.app = web.Application(middlewares=[middleware])
+        self.app.add_routes([
+            web.get('/search/issues', self.search_issues),
+            web.get('/search/commits', self.search_commits),
+            web.get(r'/repos/{owner}/{repo}/pulls/{number:\d+}', self.pull),
+            web.get(
+                r'/repos/{owner}/{repo}/pulls/{number:\d+}/files',
+                self.pull_files),
+            web.get(
+                r'/repos/{owner}/{repo}/commits/{sha:\w+}/pulls',
+                self.commit_pulls),
+            web.get('/repos/{owner}/{repo}/actions/runs', self.runs),
+            web.get(
+                r'/repos/{owner}/{repo}/actions/runs/{run:\d+}/jobs',
+                self.jobs_for_run),
+            web.post('/graphql', self.graphql),
+            web.get(r'/{owner}/{repo}/pull/{number:\d+}.diff', self.diff),
+        ])
+
+    @staticmethod
+    def resource(path):
+        if path.startswith('/search/'):
+            return 'search'
+        if path.startswith('/graphql'):
+            return 'graphql'
+        if path.startswith('/repos/'):
+            return 'core'
+        return None
+
+    async def respond(self, request, handler):
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        resource = self.resource(request.path)
+        limit = None
+        if resource is not None:
+            limit = self.limit(resource)
+            if limit[0] <= 0:
+                self.rate_limited += 1
+                return web.json_response(
+                    {'message': 'API rate limit exceeded'},
+                    status=403,
+                    headers=self.rate_limit_headers(resource, limit))
+
+        try:
+            resp = await handler(request)
+        except web.HTTPException as e:
+            resp = web.json_response({'message': e.reason}, status=e.status)
+        route = request.match_info.route.resource
+        self.served[route.canonical if route else request.path] += 1
+
+        if resp.status == 200 and resp.body is not None:
+            etag = '"{0}"'.format(hashlib.md5(resp.body).hexdigest())
+            resp.headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                self.not_modified += 1
+                resp = web.Response(status=304, headers={'ETag': etag})
+                limit = None
+
+        if limit is not None:
+            limit[0] -= 1
+        if resource is not None:
+            resp.headers.update(self.rate_limit_headers(
+                resource,
+                self.limit(resource)))
+        return resp
+
+    def limit(self, resource):
+        '''[remaining, reset] for a resource, starting a new window if due.'''
+        now = time.time()
+        limit = self.limits.get(resource)
+        if limit is None or limit[1] <= now:
+            limit = self.limits[resource] = [
+                self.rate_limits[resource],
+                int(now + self.window)]
+        return limit
+
+    def rate_limit_headers(self, resource, limit):
+        return {
+            'X-RateLimit-Limit': str(self.rate_limits[resource]),
+            'X-RateLimit-Remaining': str(max(0, limit[0])),
+            'X-RateLimit-Reset': str(limit[1]),
+            'X-RateLimit-Resource': resource,
+        }
+
+    def paginate(self, request, items, key=None, total_count=None):
+        '''
+        Respond with a page of ``items``, linking to the others like GitHub
+        does. With a ``key``, the page is wrapped in an object.
+        '''
+        per_page = min(int(request.query.get('per_page', 30)), 100)
+        page = int(request.query.get('page', 1))
+        last = max(1, -(-len(items) // per_page))
+
+        def url(n):
+            return API + str(request.rel_url.update_query(page=n))
+
+        links = []
+        if page < last:
+            links.append('<{0}>; rel="next"'.format(url(page + 1)))
+            links.append('<{0}>; rel="last"'.format(url(last)))
+        if page > 1:
+            links.append('<{0}>; rel="first"'.format(url(1)))
+            links.append('<{0}>; rel="prev"'.format(url(page - 1)))
+        headers = {'Link': ', '.join(links)} if links else {}
+
+        body = items[(page - 1) * per_page:page * per_page]
+        if key is not None:
+            body = {
+                'total_count': len(items) if total_count is None else total_count,
+                key: body,
+            }
+        return web.json_response(body, headers=headers)
+
+    def pr_number(self, request):
+        if '{owner}/{repo}'.format(**request.match_info).lower() != REPO:
+            raise web.HTTPNotFound()
+        number = int(request.match_info['number'])
+        if number not in self.repo.prs:
+            raise web.HTTPNotFound()
+        return number
+
+    def search(self, query):
+        terms = search_terms(query)
+        return [pr for pr in self.by_created if matches(pr, terms)]
+
+    async def search_issues(self, request):
+        items = [
+            {
+                'number': pr['number'],
+                'title': pr['title'],
+                'updated_at': pr['updated_at'],
+                'pull_request': {'url': pr['url']},
+            }
+            for pr in self.search(request.query.get('q', ''))
+        ]
+        return self.paginate(request, items, key='items')
+
+    async def search_commits(self, request):
+        items = []
+        hashes = [
+            value
+            for qualifier, value, negated in search_terms(
+                request.query.get('q', ''))
+            if qualifier == 'hash'
+        ]
+        for sha in self.repo.commits:
+            if any(sha.startswith(h.lower()) for h in hashes):
+                items.append({
+                    'sha': sha,
+                    'repository': {'full_name': REPO},
+                })
+        return self.paginate(request, items, key='items')
+
+    async def pull(self, request):
+        return web.json_response(self.repo.prs[self.pr_number(request)])
+
+    async def pull_files(self, request):
+        return self.paginate(request, self.repo.files[self.pr_number(request)])
+
+    async def diff(self, request):
+        return web.Response(text=self.repo.diff(self.pr_number(request)))
+
+    async def commit_pulls(self, request):
+        number = self.repo.commits.get(request.match_info['sha'].lower())
+        prs = [] if number is None else [self.repo.prs[number]]
+        return web.json_response(prs)
+
+    async def runs(self, request):
+        run = {
+            'id': 1,
+            'status': 'completed',
+            'conclusion': 'success',
+            'jobs_url': '{0}/repos/{owner}/{repo}/actions/runs/1/jobs'.format(
+                API,
+                **request.match_info),
+        }
+        return self.paginate(request, [run], key='workflow_runs')
+
+    async def jobs_for_run(self, request):
+        jobs = [
+            {
+                'id': n,
+                'name': 'test {0}'.format(n),
+                'html_url': '{0}/{owner}/{repo}/runs/{1}'.format(
+                    WEB,
+                    n,
+                    **request.match_info),
+                'status': 'completed',
+                'conclusion': 'failure' if n % 10 == 0 else 'success',
+                'started_at': timestamp(n),
+                'completed_at': timestamp(n + 5),
+            }
+            for n in range(1, self.jobs + 1)
+        ]
+        return self.paginate(request, jobs, key='jobs')
+
+    async def graphql(self, request):
+        payload = await request.json()
+        query = payload['query']
+        variables = payload.get('variables') or {}
+        if 'search(' in query:
+            return web.json_response(
+                {'data': {'search': self.graphql_search(**variables)}})
+        if 'issueOrPullRequest' in query:
+            return web.json_response(self.graphql_classify(query))
+        return web.json_response(
+            {'errors': [{'message': 'fakegithub: unsupported query'}]})
+
+    def graphql_search(self, q, first, after=None):
+        prs = self.search(q)
+        start = int(after or 0)
+        end = start + first
+        return {
+            'pageInfo': {
+                'hasNextPage': end < len(prs),
+                'endCursor': str(end),
+            },
+            'nodes': [self.graphql_pr(pr) for pr in prs[start:end]],
+        }
+
+    def graphql_pr(self, pr):
+        '''A PR as a PullRequest node of releasible.graphql's search.'''
+        files = self.repo.files[pr['number']]
+        return {
+            'number': pr['number'],
+            'title': pr['title'],
+            'body': pr['body'],
+            'url': pr['html_url'],
+            'createdAt': pr['created_at'],
+            'updatedAt': pr['updated_at'],
+            'baseRefName': pr['base']['ref'],
+            'additions': pr['additions'],
+            'deletions': pr['deletions'],
+            'changedFiles': pr['changed_files'],
+            'author': {
+                'login': pr['user']['login'],
+                'url': pr['user']['html_url'],
+            },
+            'repository': {'nameWithOwner': REPO},
+            'comments': {'totalCount': pr['comments']},
+            'reviews': {'nodes': [
+                {'comments': {'totalCount': pr['review_comments']}},
+            ]},
+            'commits': {'totalCount': pr['commits']},
+            'labels': {'nodes': [
+                {'name': label['name']} for label in pr['labels']
+            ]},
+            'files': {
+                'pageInfo': {'hasNextPage': len(files) > 100},
+                'nodes': [
+                    {
+                        'path': f['filename'],
+                        'additions': f['additions'],
+                        'deletions': f['deletions'],
+                    }
+                    for f in files[:100]
+                ],
+            },
+        }
+
+    def graphql_classify(self, query):
+        data = {}
+        errors = []
+        repo = None
+        for match in CLASSIFY_FIELD.finditer(query):
+            if match.group('repo_alias'):
+                name = '{0}/{1}'.format(
+                    json.loads(match.group('owner')),
+                    json.loads(match.group('name')))
+                repo_alias = match.group('repo_alias')
+                repo = data[repo_alias] = (
+                    {} if name.lower() == REPO else None)
+                if repo is None:
+                    errors.append({
+                        'type': 'NOT_FOUND',
+                        'path': [repo_alias],
+                        'message': 'Could not resolve to a Repository '
+                                   'with the name {0!r}.'.format(name),
+                    })
+                continue
+            if repo is None:
+                continue
+            number = int(match.group('number'))
+            if number in self.repo.prs:
+                repo[match.group('alias')] = {'__typename': 'PullRequest'}
+            elif number in self.repo.issues:
+                repo[match.group('alias')] = {'__typename': 'Issue'}
+            else:
+                repo[match.group('alias')] = None
+                errors.append({
+                    'type': 'NOT_FOUND',
+                    'path': [repo_alias, match.group('alias')],
+                    'message': 'Could not resolve to an issue or pull '
+                               'request with the number of {0}.'.format(number),
+                })
+
+        out = {'data': data}
+        if errors:
+            out['errors'] = errors
+        return out
+
+@contextlib.asynccontextmanager
+async def serve(fake, host='127.0.0.1', port=0):
+    '''Serve a FakeGitHub in the background, yielding its root URL.'''
+    runner = web.AppRunner(fake.app)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        yield 'http://{0}:{1}'.format(host, port)
+    finally:
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument(
+        '--versions', default='2.8,2.9,2.10,2.11',
+        help='comma-separated versions to make stable branches for')
+    parser.add_argument(
+        '--backports', type=int, default=1000,
+        help='how many PRs to backport to each branch')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--rate-limit', type=int, default=5000)
+    parser.add_argument('--search-rate-limit', type=int, default=30)
+    parser.add_argument(
+        '--rate-limit-window', type=float, default=3600,
+        help='seconds until the rate limits reset')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    repo = make_repo(
+        versions=args.versions.split(','),
+        backports=args.backports,
+        seed=args.seed)
+    fake = FakeGitHub(
+        repo,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        search_rate_limit=args.search_rate_limit,
+        rate_limit_window=args.rate_limit_window,
+        seed=args.seed)
+    print('Serving {0} PRs'.format(len(repo.prs)))
+    web.run_app(fake.app, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+class FakeResponse:
+    '''Stands in for an aiohttp.ClientResponse, used as a context manager.'''
+    def __init__(self, status, body='', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def read(self):
+        return self.body.encode('utf-8')
+
+    async def text(self):
+        return self.body
+
+    def get_encoding(self):
+        return 'utf-8'
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+class FakeSession:
+    '''
+    Stands in for aiohttp.ClientSession. ``responses`` maps an endpoint to a
+    function taking the request headers and returning a FakeResponse.
+    '''
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def request(self, method, endpoint, headers=None, **kwargs):
+        self.requests.append((endpoint, headers))
+        return self.responses[endpoint](headers)
+
+    def get(self, endpoint, headers=None, **kwargs):
+        return self.request('GET', endpoint, headers, **kwargs)
@@ -1,10 +1,13 @@
 import aiohttp
+import asyncio
 import pytest
+import pytest_asyncio
 import re
 from releasible.backport import *
+from releasible.github import GitHubAPIError
 from typing import Dict
 
-@pytest.fixture
+@pytest_asyncio.fixture
 async def finder():
     import os
     aio_session = aiohttp.ClientSession()
@@ -12,6 +15,66 @@ async def finder():
     yield BackportFinder(token, aio_session)
     await aio_session.close()
 
+class CannedFinder(BackportFinder):
+    '''
+    A BackportFinder which answers every request with a minimal PR instead of
+    going to GitHub, and remembers what it was asked for.
+    '''
+    def __init__(self):
+        super().__init__(None, None)
+        self.requested = []
+        # Numbers which are issues rather than PRs.
+        self.issues = set()
+
+    async def get(self, endpoint, json=True):
+        self.requested.append(endpoint)
+        await asyncio.sleep(0)
+        if not json:
+            return ''
+        number = int(endpoint.rsplit('/', 1)[1])
+        if number in self.issues:
+            raise GitHubAPIError(endpoint, 404, 'Not Found')
+        return {
+            'number': number,
+            'url': endpoint,
+            'diff_url': endpoint + '.diff',
+            'updated_at': '2021-02-27T07:10:37Z',
+            'title': 'Foo (backport of #{0})'.format(number + 1),
+            'body': '',
+        }
+
+    async def get_summary(self, endpoint, summarize):
+        self.requested.append(endpoint)
+        return []
+
+def graphql_node(number, files_truncated=False):
+    return {
+        'number': number,
+        'title': 'Backport #{0}'.format(number),
+        'body': '',
+        'url': 'https://github.com/ansible/ansible/pull/{0}'.format(number),
+        'createdAt': '2021-02-27T07:10:37Z',
+        'updatedAt': '2021-02-27T07:10:37Z',
+        'baseRefName': 'stable-2.10',
+        'additions': 12,
+        'deletions': 3,
+        'changedFiles': 2,
+        'author': {'login': 'relrod', 'url': 'https://github.com/relrod'},
+        'repository': {'nameWithOwner': 'ansible/ansible'},
+        'comments': {'totalCount': 1},
+        'reviews': {'nodes': [{'comments': {'totalCount': 2}}]},
+        'commits': {'totalCount': 1},
+        'labels': {'nodes': [{'name': 'backport'}]},
+        'files': {
+            'pageInfo': {'hasNextPage': files_truncated},
+            'nodes': [
+                {'path': 'lib/ansible/foo.py', 'additions': 10, 'deletions': 3},
+                {'path': 'changelogs/fragments/foo.yml', 'additions': 2,
+                 'deletions': 0},
+            ],
+        },
+    }
+
 def test_normalize_pr_url():
     ANSI_URL = 'https://github.com/ansible/ansible/pull/1234'
     ANSI_API_URL = 'https://api.github.com/repos/ansible/ansible/pulls/1234'
@@ -43,6 +106,353 @@ def test_normalize_pr_url():
         allow_non_ansible_ansible=True,
         only_number=True) == 1176
 
+@pytest.mark.asyncio
+async def test_get_pr_is_fetched_once():
+    finder = CannedFinder()
+    prs = await asyncio.gather(
+        finder.get_pr('1234'),
+        finder.get_pr('ansible/ansible#1234'),
+        finder.get_pr('https://github.com/ansible/ansible/pull/1234'))
+    assert [pr.number for pr in prs] == [1234, 1234, 1234]
+
+    assert (await finder.get_pr(1234)).number == 1234
+    assert finder.requested == [
+        'https://api.github.com/repos/ansible/ansible/pulls/1234',
+        'https://api.github.com/repos/ansible/ansible/pulls/1234.diff',
+    ]
+
+@pytest.mark.asyncio
+async def test_get_backports_for_version_graphql():
+    finder = CannedFinder()
+    finder.graphql_batch_size = 2
+    pages = [
+        {'nodes': [graphql_node(1), graphql_node(2, files_truncated=True)],
+         'pageInfo': {'hasNextPage': True, 'endCursor': 'abc'}},
+        {'nodes': [graphql_node(3)],
+         'pageInfo': {'hasNextPage': False, 'endCursor': None}},
+    ]
+    queries = []
+
+    async def graphql(query, **variables):
+        queries.append(variables)
+        return {'search': pages[len(queries) - 1]}
+    finder.graphql = graphql
+
+    prs = await finder.get_backports_for_version('2.10')
+    assert [pr.number for pr in prs] == [1, 2, 3]
+    assert [q['after'] for q in queries] == [None, 'abc']
+    assert 'base:stable-2.10' in queries[0]['q']
+
+    # Only the PR with too many files to list went over REST.
+    assert finder.requested == [
+        'https://api.github.com/repos/ansible/ansible/pulls/2',
+        'https://api.github.com/repos/ansible/ansible/pulls/2.diff',
+    ]
+
+    assert prs[0].pr['user']['login'] == 'relrod'
+    assert prs[0].pr['review_comments'] == 2
+    assert not prs[0].is_missing_changelog
+    assert (await finder.get_pr(1)) is prs[0]
+
+@pytest.mark.asyncio
+async def test_iter_backports_for_version_yields_as_found():
+    finder = CannedFinder()
+    found = [
+        {'number': n, 'updated_at': '2021-02-27T07:10:37Z'}
+        for n in (10, 11, 12)
+    ]
+
+    async def iter_pages(endpoint, key=None, prefetch=4):
+        assert 'base:stable-2.10' in endpoint
+        for pr in found:
+            yield pr
+    finder.iter_pages = iter_pages
+
+    prs = finder.iter_backports_for_version('2.10', window=1)
+    assert (await prs.__anext__()).number == 10
+    await prs.aclose()
+    # We stopped early, so at most the PR queued behind the first was fetched.
+    assert 'https://api.github.com/repos/ansible/ansible/pulls/12' \
+        not in finder.requested
+
+    finder = CannedFinder()
+    finder.iter_pages = iter_pages
+    prs = await finder.get_backports_for_version('2.10')
+    assert [pr.number for pr in prs] == [10, 11, 12]
+
+@pytest.mark.asyncio
+async def test_prs_for_commit_checks_commit_index_first():
+    class Index:
+        def lookup(self, sha):
+            return [('ansible/ansible', 1234)] if sha == 'abc123' else []
+
+    finder = CannedFinder()
+    finder.commit_index = Index()
+    assert [pr.number for pr in await finder.prs_for_commit('abc123')] == \
+        [1234]
+    assert not any('/search/' in url for url in finder.requested)
+
+@pytest.mark.asyncio
+async def test_commit_searches_are_batched():
+    class Searcher:
+        def __init__(self):
+            self.requested = []
+
+        async def get(self, endpoint):
+            self.requested.append(endpoint)
+            return {'items': [
+                {'sha': sha + '0' * 32}
+                for sha in re.findall(r'hash:(\w+)', endpoint)
+                if sha != 'f' * 8
+            ]}
+
+    searcher = Searcher()
+    batcher = CommitSearchBatcher(searcher, window=0.01)
+    shas = ['{0:08x}'.format(n) for n in range(8)] + ['f' * 8]
+    results = await asyncio.gather(
+        *[batcher.search(sha) for sha in shas + shas[:2]])
+
+    assert [[item['sha'][:8] for item in found] for found in results] == \
+        [[sha] for sha in shas[:-1]] + [[]] + [[sha] for sha in shas[:2]]
+    # Nine hashes fit in one query, counting duplicates once.
+    assert len(searcher.requested) == 1
+    assert all(len(url.split('q=', 1)[1]) <= MAX_SEARCH_QUERY_LENGTH
+               for url in searcher.requested)
+
+    # A commit on its own is searched for like it always was.
+    assert await batcher.search('abc123') == [{'sha': 'abc123' + '0' * 32}]
+    assert searcher.requested[-1] == (
+        'https://api.github.com/search/commits?per_page=100&'
+        'q=hash:abc123 org:ansible org:ansible-collections is:public')
+
+@pytest.mark.asyncio
+async def test_guess_original_pr_limit_cancels_the_rest():
+    finder = CannedFinder()
+    pr = await finder.get_pr(1)
+    pr.pr['body'] = 'cherry picked from commit abc123\nSee also #7'
+
+    cancelled = []
+
+    async def prs_for_commit(sha):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(sha)
+            raise
+    finder.prs_for_commit = prs_for_commit
+
+    originals = await asyncio.wait_for(
+        finder.guess_original_pr(pr, limit=1),
+        timeout=1)
+    assert [o.number for o in originals] == [2]
+    assert cancelled == ['abc123']
+
+    # Without a limit, every reference counts, in the same order as before.
+    async def prs_for_commit(sha):
+        return [await finder.get_pr(5)]
+    finder.prs_for_commit = prs_for_commit
+    originals = await finder.guess_original_pr(pr)
+    assert [o.number for o in originals] == [2, 5, 7]
+
+@pytest.mark.asyncio
+async def test_store_skips_unchanged_prs(tmp_path):
+    from releasible.store import BackportStore
+    store = BackportStore(str(tmp_path / 'backports.sqlite'))
+
+    finder = CannedFinder()
+    finder.store = store
+    pr = await finder.get_pr(1, updated_at='2021-02-27T07:10:37Z')
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [2]
+    assert len(finder.requested) == 4
+
+    # Nothing changed, so a later build doesn't need to ask GitHub at all.
+    finder = CannedFinder()
+    finder.store = store
+    pr = await finder.get_pr(1, updated_at='2021-02-27T07:10:37Z')
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [2]
+    assert finder.requested == []
+
+    # But once the backport is updated, it and its originals are looked at
+    # again.
+    finder = CannedFinder()
+    finder.store = store
+    pr = await finder.get_pr(1, updated_at='2021-03-01T00:00:00Z')
+    pr.pr['title'] = 'Foo (backport of #3)'
+    pr.pr['updated_at'] = '2021-03-01T00:00:00Z'
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [3]
+    assert len(finder.requested) == 4
+
+@pytest.mark.asyncio
+async def test_store_skips_originals_after_errors(tmp_path):
+    from releasible.store import BackportStore
+    store = BackportStore(str(tmp_path / 'backports.sqlite'))
+
+    class FlakyFinder(CannedFinder):
+        # Numbers GitHub fails to answer for.
+        failing = {2}
+
+        async def get(self, endpoint, json=True):
+            if json and int(endpoint.rsplit('/', 1)[1]) in self.failing:
+                self.requested.append(endpoint)
+                raise GitHubAPIError(endpoint, 502, 'Bad Gateway')
+            return await super().get(endpoint, json)
+
+    finder = FlakyFinder()
+    finder.store = store
+    finder.issues = {3}
+    pr = await finder.get_pr(1, updated_at='2021-02-27T07:10:37Z')
+    pr.pr['body'] = 'See #3 and #4'
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [4]
+    # #2 might well have been the original, so don't go by this next time.
+    assert store.get_originals(pr) is None
+
+    FlakyFinder.failing = set()
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [2, 4]
+    assert len(store.get_originals(pr)) == 2
+
+@pytest.mark.asyncio
+async def test_store_remembers_limited_originals(tmp_path):
+    from releasible.store import BackportStore
+    store = BackportStore(str(tmp_path / 'backports.sqlite'))
+
+    finder = CannedFinder()
+    pr = await finder.get_pr(1)
+    originals = [await finder.get_pr(2), await finder.get_pr(3)]
+
+    store.put_originals(pr, originals[:1], limit=1)
+    assert store.get_originals(pr, limit=1) == [originals[0].pr['url']]
+    # There might have been more than one.
+    assert store.get_originals(pr, limit=2) is None
+    assert store.get_originals(pr) is None
+
+    store.put_originals(pr, originals)
+    assert store.get_originals(pr, limit=1) == [originals[0].pr['url']]
+    assert len(store.get_originals(pr)) == 2
+
+    # One commit which went into two PRs, the second cut off by the limit.
+    finder = CannedFinder()
+    finder.store = BackportStore(':memory:')
+    pr = await finder.get_pr(1)
+    pr.pr['title'] = 'Foo'
+    pr.pr['body'] = '(cherry picked from commit abc123)'
+
+    async def prs_for_commit(sha):
+        return [await finder.get_pr(5), await finder.get_pr(6)]
+    finder.prs_for_commit = prs_for_commit
+
+    assert [o.number for o in await finder.guess_original_pr(pr, limit=1)] \
+        == [5]
+    assert finder.store.get_originals(pr) is None
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [5, 6]
+
+@pytest.mark.asyncio
+async def test_issues_are_not_looked_up_again(tmp_path):
+    from releasible.store import BackportStore
+    store = BackportStore(str(tmp_path / 'backports.sqlite'))
+    issue = 'https://api.github.com/repos/ansible/ansible/pulls/999'
+
+    finder = CannedFinder()
+    finder.store = store
+    finder.issues.add(999)
+    pr = await finder.get_pr(1)
+    pr.pr['body'] = 'Fixes #999\nAlso fixes #999'
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [2]
+    assert finder.requested.count(issue) == 1
+    with pytest.raises(NotAPullRequest):
+        await finder.get_pr(999)
+
+    # Nor in later builds, until the TTL runs out.
+    finder = CannedFinder()
+    finder.store = store
+    with pytest.raises(NotAPullRequest):
+        await finder.get_pr(999)
+    finder.not_pr_ttl = 0
+    with pytest.raises(GitHubAPIError):
+        finder.issues.add(999)
+        await finder.get_pr(999)
+
+@pytest.mark.asyncio
+async def test_classify_pr_references():
+    finder = CannedFinder()
+    finder.classify_references = True
+    queries = []
+    # What had been fetched by the time the query was answered.
+    fetched = []
+
+    async def graphql_with_errors(query, **variables):
+        queries.append(query)
+        await asyncio.sleep(0.01)
+        fetched.extend(finder.requested)
+        return {
+            'r0': {
+                'n0': {'__typename': 'PullRequest'},
+                'n1': {'__typename': 'Issue'},
+                'n2': None,
+            },
+            'r1': None,
+        }, [
+            {'type': 'NOT_FOUND', 'path': ['r0', 'n2']},
+            {'type': 'NOT_FOUND', 'path': ['r1']},
+        ]
+    finder.graphql_with_errors = graphql_with_errors
+
+    pr = await finder.get_pr(1)
+    pr.pr['body'] = 'Fixes #3, #4 and #5\nSee someone/gone#6'
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [2, 3]
+    assert len(queries) == 1
+    assert 'issueOrPullRequest(number: 5)' in queries[0]
+    # The title's reference doesn't wait for (or go in) the query.
+    assert 'issueOrPullRequest(number: 2)' not in queries[0]
+    assert 'https://api.github.com/repos/ansible/ansible/pulls/2' in fetched
+    assert 'repository(owner: "someone", name: "gone")' in queries[0]
+    # Only the PRs were fetched.
+    assert sorted(url.rsplit('/', 1)[1] for url in finder.requested) == \
+        ['1', '1.diff', '2', '2.diff', '3', '3.diff']
+
+@pytest.mark.asyncio
+async def test_classify_pr_references_unknowns():
+    finder = CannedFinder()
+    finder.classify_references = True
+    queries = []
+
+    async def graphql_with_errors(query, **variables):
+        queries.append(query)
+        return {
+            'r0': {
+                'n0': None,
+                'n1': None,
+            },
+        }, [
+            {'type': 'FORBIDDEN', 'path': ['r0', 'n0']},
+            {'type': 'NOT_FOUND', 'path': ['r0', 'n1']},
+        ]
+    finder.graphql_with_errors = graphql_with_errors
+
+    pr = await finder.get_pr(1)
+    pr.pr['body'] = 'Fixes #3 and #5'
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [2, 3]
+    assert 'issueOrPullRequest(number: 3)' in queries[0]
+    # Null without NOT_FOUND (#3) could be anything, so get_pr finds out.
+    assert sorted(url.rsplit('/', 1)[1] for url in finder.requested) == \
+        ['1', '1.diff', '2', '2.diff', '3', '3.diff']
+    assert not finder._is_not_pr(normalize_pr_url(3, api=True))
+    assert finder._is_not_pr(normalize_pr_url(5, api=True))
+
+@pytest.mark.asyncio
+async def test_classify_pr_references_failing():
+    finder = CannedFinder()
+    finder.classify_references = True
+    finder.issues = {3}
+
+    async def graphql_with_errors(query, **variables):
+        raise GitHubAPIError('https://api.github.com/graphql', 502, 'Oops')
+    finder.graphql_with_errors = graphql_with_errors
+
+    pr = await finder.get_pr(1)
+    pr.pr['body'] = 'Fixes #3 and #4'
+    # get_pr finds out instead.
+    assert [o.number for o in await finder.guess_original_pr(pr)] == [2, 4]
+
 @pytest.mark.vcr(filter_headers=['authorization'])
 @pytest.mark.asyncio
 async def test_prs_for_commit(finder):
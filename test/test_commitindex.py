@@ -0,0 +1,67 @@
+import subprocess
+import pytest
+from releasible.commitindex import CommitIndex
+
+def git(repo, *args):
+    return subprocess.run(
+        ['git', '-C', str(repo)] + list(args),
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True).stdout.strip()
+
+def commit(repo, subject):
+    git(repo, 'commit', '--allow-empty', '-q', '-m', subject)
+    return git(repo, 'rev-parse', 'HEAD')
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / 'ansible'
+    repo.mkdir()
+    git(repo, 'init', '-q', '-b', 'devel')
+    git(repo, 'config', 'user.name', 'Test')
+    git(repo, 'config', 'user.email', 'test@example.com')
+    return repo
+
+def test_update_indexes_new_commits(repo, tmp_path):
+    index = CommitIndex(str(tmp_path / 'commits.sqlite'))
+    squashed = commit(repo, 'Fix the thing (#1234)')
+    unrelated = commit(repo, 'Not from a PR')
+
+    git(repo, 'checkout', '-q', '-b', 'feature')
+    feature = commit(repo, 'Add a feature')
+    git(repo, 'checkout', '-q', 'devel')
+    git(repo, 'merge', '-q', '--no-ff', '-m',
+        'Merge pull request #99 from someone/feature', 'feature')
+    merge = git(repo, 'rev-parse', 'HEAD')
+    git(repo, 'update-ref', 'refs/pull/7/head', feature)
+
+    assert index.update('ansible/ansible', str(repo)) == 4
+    assert index.lookup(squashed) == [('ansible/ansible', 1234)]
+    assert index.lookup(squashed[:8].upper()) == [('ansible/ansible', 1234)]
+    assert index.lookup(merge) == [('ansible/ansible', 99)]
+    assert index.lookup(feature) == [('ansible/ansible', 7), ('ansible/ansible', 99)]
+    assert index.lookup(unrelated) == []
+
+    # Only what's new is looked at next time.
+    assert index.update('ansible/ansible', str(repo)) == 0
+    newer = commit(repo, 'Fix another thing (#1235)')
+    assert index.update('ansible/ansible', str(repo)) == 1
+    assert index.lookup(newer) == [('ansible/ansible', 1235)]
+
+def test_update_survives_force_push(repo, tmp_path):
+    index = CommitIndex(str(tmp_path / 'commits.sqlite'))
+    commit(repo, 'Fix the thing (#1)')
+    git(repo, 'checkout', '-q', '-b', 'feature')
+    gone = commit(repo, 'Fix another thing (#2)')
+    assert index.update('ansible/ansible', str(repo)) == 2
+
+    # Rewrite the branch and let the old tip be collected.
+    git(repo, 'reset', '-q', '--hard', 'devel')
+    rewritten = commit(repo, 'Fix another thing again (#3)')
+    git(repo, 'reflog', 'expire', '--expire=now', '--all')
+    git(repo, 'gc', '-q', '--prune=now')
+    assert subprocess.run(
+        ['git', '-C', str(repo), 'cat-file', '-e', gone]).returncode != 0
+
+    assert index.update('ansible/ansible', str(repo)) == 1
+    assert index.lookup(rewritten) == [('ansible/ansible', 3)]
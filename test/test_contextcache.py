@@ -0,0 +1,55 @@
+from releasible.contextcache import ContextCache
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+def make_cache(ttl):
+    fetched = []
+
+    def fetch(names):
+        fetched.append(sorted(names))
+        return {
+            name: {'fetch': len(fetched)}
+            for name in names if name != 'static'
+        }
+
+    clock = Clock()
+    return ContextCache(fetch, ttl, clock), fetched, clock
+
+def test_served_from_memory_until_expired():
+    cache, fetched, clock = make_cache(ttl=60)
+    cache.update({'backports': {'fetch': 0}})
+
+    assert cache.get('backports') == {'fetch': 0}
+    # Pages without a context are only asked about once per TTL too.
+    assert cache.get('static') == {}
+    assert cache.get('static') == {}
+    assert fetched == [['static']]
+
+    clock.now = 60
+    assert cache.get('backports') == {'fetch': 2}
+    assert cache.get('backports') == {'fetch': 2}
+    assert fetched == [['static'], ['backports']]
+
+def test_no_ttl_never_expires():
+    cache, fetched, clock = make_cache(ttl=None)
+    cache.update({'backports': {'fetch': 0}})
+    clock.now = 10 ** 9
+    assert cache.get('backports') == {'fetch': 0}
+    assert fetched == []
+
+def test_refresh_and_expire():
+    cache, fetched, clock = make_cache(ttl=None)
+    cache.update({'backports': {'fetch': 0}, 'aut': {'fetch': 0}})
+
+    cache.refresh()
+    assert fetched == [['aut', 'backports']]
+    assert cache.get('aut') == {'fetch': 1}
+
+    cache.expire()
+    assert cache.get('aut') == {'fetch': 2}
+    assert fetched[-1] == ['aut']
@@ -0,0 +1,78 @@
+import functools
+import os.path
+import pytest
+from releasible.diffstat import *
+from releasible.github import GitHubAPICall
+from releasible.model.pullrequest import FileStat
+from unidiff import PatchSet
+import yaml
+
+CASSETTES = os.path.join(os.path.dirname(__file__), 'cassettes')
+
+@functools.lru_cache()
+def cassette_diffs():
+    '''Every diff recorded in the test cassettes.'''
+    diffs = []
+    for name in sorted(os.listdir(CASSETTES)):
+        with open(os.path.join(CASSETTES, name)) as f:
+            cassette = yaml.safe_load(f)
+        for interaction in cassette['interactions']:
+            uri = interaction['request']['uri']
+            if uri.startswith('https://patch-diff.githubusercontent.com/'):
+                diffs.append(
+                    pytest.param(
+                        interaction['response']['body']['string'],
+                        id=uri.split('/raw/')[1]))
+    return diffs
+
+@pytest.mark.parametrize('diff', cassette_diffs())
+def test_file_stats_matches_unidiff(diff):
+    expected = [
+        FileStat(f.path, f.added, f.removed)
+        for f in PatchSet(diff)
+    ]
+    assert file_stats(diff) == expected
+
+@pytest.mark.asyncio
+async def test_iter_file_stats_streams_chunks():
+    diff = cassette_diffs()[0].values[0]
+
+    class Content:
+        async def iter_chunked(self, size):
+            # Deliberately split lines (and maybe characters) across chunks.
+            raw = diff.encode('utf-8')
+            for start in range(0, len(raw), 7):
+                yield raw[start:start + 7]
+
+    class Response:
+        content = Content()
+
+    client = GitHubAPICall(None, None)
+    stats = [
+        stat async for stat in iter_file_stats(client.iter_lines(Response()))
+    ]
+    assert stats == file_stats(diff)
+
+def test_file_stats_edge_cases():
+    diff = '\n'.join([
+        'diff --git a/old.py b/new.py',
+        'similarity index 100%',
+        'rename from old.py',
+        'rename to new.py',
+        'diff --git a/logo.png b/logo.png',
+        'new file mode 100644',
+        'index 0000000..e69de29',
+        'Binary files /dev/null and b/logo.png differ',
+        'diff --git a/gone.txt b/gone.txt',
+        'deleted file mode 100644',
+        '--- a/gone.txt',
+        '+++ /dev/null',
+        '@@ -1 +0,0 @@',
+        '-bye',
+        '\\ No newline at end of file',
+    ])
+    assert file_stats(diff) == [
+        FileStat('new.py', 0, 0),
+        FileStat('logo.png', 0, 0),
+        FileStat('gone.txt', 0, 1),
+    ]
@@ -0,0 +1,86 @@
+import aiohttp
+import pytest
+import pytest_asyncio
+from releasible.backport import BackportFinder
+from releasible.cache import open_cache
+from releasible.github import RequestScheduler
+from test.fakegithub import FakeGitHub, make_repo, serve
+
+@pytest_asyncio.fixture
+async def fake():
+    # A short rate limit window, so that running out doesn't mean waiting an
+    # hour for the reset.
+    fake = FakeGitHub(
+        make_repo(versions=['2.10', '2.11'], backports=120),
+        rate_limit_window=1)
+    async with serve(fake) as server:
+        async with aiohttp.ClientSession() as aio_session:
+            yield fake, server, aio_session
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('graphql_batch_size', [None, 50])
+async def test_backports_and_originals(fake, graphql_batch_size):
+    fake, server, aio_session = fake
+    finder = BackportFinder(
+        None,
+        aio_session,
+        scheduler=RequestScheduler(reserve=0),
+        server=server,
+        graphql_batch_size=graphql_batch_size,
+        classify_references=True)
+
+    prs = await finder.get_backports_for_version('2.10')
+    assert len(prs) == 120
+    assert all(pr.pr['base']['ref'] == 'stable-2.10' for pr in prs)
+    assert all(pr.files for pr in prs)
+
+    for pr in prs[:20]:
+        [original] = await finder.guess_original_pr(pr, limit=1)
+        assert original.pr['base']['ref'] == 'devel'
+        assert original.pr['title'] in pr.pr['title']
+
+    # Only PRs are asked for: the issues are found out with one GraphQL
+    # query rather than a 404 each.
+    assert fake.served['/repos/{owner}/{repo}/pulls/{number}'] == 20 + (
+        0 if graphql_batch_size else 120)
+
+@pytest.mark.asyncio
+async def test_revalidation_is_free(fake, tmp_path):
+    fake, server, aio_session = fake
+    fake.window = 60
+    cache = open_cache(str(tmp_path / 'cache.sqlite'))
+    url = 'https://api.github.com/repos/ansible/ansible/pulls/70000'
+
+    finder = BackportFinder(None, aio_session, cache, server=server)
+    await finder.get(url)
+    remaining = fake.limits['core'][0]
+
+    finder = BackportFinder(None, aio_session, cache, server=server)
+    assert (await finder.get(url))['number'] == 70000
+    assert finder.cache_revalidations == 1
+    assert fake.not_modified == 1
+    assert fake.limits['core'][0] == remaining
+
+@pytest.mark.asyncio
+async def test_rate_limit(fake):
+    fake, server, aio_session = fake
+    fake.rate_limits['search'] = 2
+    url = server + '/search/issues?per_page=100&q=is:pr'
+
+    for remaining in ('1', '0'):
+        async with aio_session.get(url) as resp:
+            assert resp.status == 200
+            assert resp.headers['X-RateLimit-Remaining'] == remaining
+    async with aio_session.get(url) as resp:
+        assert resp.status == 403
+        assert resp.headers['X-RateLimit-Resource'] == 'search'
+    assert fake.rate_limited == 1
+
+    # The scheduler sees the budget being spent and waits for the reset.
+    scheduler = RequestScheduler(reserve=0)
+    finder = BackportFinder(
+        None, aio_session, scheduler=scheduler, server=server)
+    endpoint = 'https://api.github.com/search/issues?per_page=100&q=is:pr'
+    for _ in range(3):
+        assert (await finder.get(endpoint))['total_count'] == len(fake.repo.prs)
+    assert scheduler.waited + scheduler.retries > 0
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import pytest
+import time
+from releasible.cache import *
+from releasible.github import *
+from test.fakes import FakeResponse, FakeSession
+
+def etag_endpoint(headers):
+    if headers.get('If-None-Match') == '"abc"':
+        return FakeResponse(304)
+    return FakeResponse(200, '{"number": 1}', {'etag': '"abc"'})
+
+def rate_limited_once(status, headers):
+    attempts = []
+
+    def endpoint(request_headers):
+        attempts.append(request_headers)
+        if len(attempts) == 1:
+            return FakeResponse(status, 'API rate limit exceeded', headers)
+        return FakeResponse(200, '[]', {
+            'x-ratelimit-remaining': '4999',
+            'x-ratelimit-reset': '0',
+        })
+    return endpoint
+
+@pytest.mark.parametrize('filename', ['cache.sqlite', 'cache'])
+def test_response_cache_roundtrip(tmp_path, filename):
+    cache = open_cache(str(tmp_path / filename))
+    assert cache.get('https://example.com/') is None
+
+    cache.put(
+        'https://example.com/',
+        CachedResponse('body', '"abc"', 'yesterday', None))
+    entry = cache.get('https://example.com/')
+    assert entry.body == 'body'
+    assert entry.conditional_headers() == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'yesterday',
+    }
+    cache.close()
+
+@pytest.mark.asyncio
+async def test_get_revalidates_cached_response(tmp_path):
+    url = 'https://api.github.com/repos/ansible/ansible/pulls/1'
+    session = FakeSession({url: etag_endpoint})
+    cache = open_cache(str(tmp_path / 'cache.sqlite'))
+
+    client = GitHubAPICall('token', session, cache)
+    assert await client.get(url) == {'number': 1}
+    assert 'If-None-Match' not in session.requests[-1][1]
+
+    client = GitHubAPICall('token', session, cache)
+    assert await client.get(url) == {'number': 1}
+    assert session.requests[-1][1]['If-None-Match'] == '"abc"'
+    assert client.calls == 1
+    assert client.cache_hits == 1
+    assert client.cache_misses == 0
+    assert client.cache_revalidations == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('status,headers', [
+    (429, {'retry-after': '0'}),
+    (403, {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '0'}),
+    (403, {}),
+])
+async def test_get_retries_when_rate_limited(status, headers):
+    url = 'https://api.github.com/repos/ansible/ansible/pulls'
+    session = FakeSession({url: rate_limited_once(status, headers)})
+    scheduler = RequestScheduler(backoff=0)
+
+    client = GitHubAPICall('token', session, scheduler=scheduler)
+    assert await client.get(url) == []
+    assert len(session.requests) == 2
+    assert scheduler.retries == 1
+    assert scheduler.requests == 2
+    assert scheduler.limits['core'].remaining == 4999
+    assert scheduler.limits['core'].reset == 0
+    assert scheduler.throughput() > 0
+
+@pytest.mark.asyncio
+async def test_tracer_records_requests(tmp_path):
+    from releasible.trace import Tracer, phase
+
+    url = 'https://api.github.com/repos/ansible/ansible/pulls/1'
+    session = FakeSession({url: etag_endpoint})
+    cache = open_cache(str(tmp_path / 'cache.sqlite'))
+    tracer = Tracer()
+
+    client = GitHubAPICall('token', session, cache, tracer=tracer)
+    with phase('get_pr'):
+        await client.get(url)
+        await client.get(url)
+
+    first, second = tracer.requests
+    assert (first.status, first.cache, first.phase) == (200, 'miss', 'get_pr')
+    assert first.bytes == len('{"number": 1}')
+    assert (second.status, second.cache) == (304, 'hit')
+
+    [row] = tracer.summary()
+    assert row['endpoint'] == (
+        'https://api.github.com/repos/:owner/:repo/pulls/:number')
+    assert (row['count'], row['errors'], row['cache_hits']) == (2, 0, 1)
+
+    events = tracer.chrome_trace()['traceEvents']
+    assert [event['ph'] for event in events] == ['b', 'e', 'b', 'e']
+    assert events[0]['cat'] == 'get_pr'
+
+@pytest.mark.asyncio
+async def test_tracer_counts_bytes_not_characters():
+    from releasible.trace import Tracer
+
+    url = 'https://api.github.com/repos/ansible/ansible/pulls/1'
+    body = '{"title": "Ça marche \u2713"}'
+    session = FakeSession({url: lambda headers: FakeResponse(200, body)})
+    tracer = Tracer()
+
+    client = GitHubAPICall('token', session, tracer=tracer)
+    assert (await client.get(url))['title'] == 'Ça marche \u2713'
+    assert tracer.requests[0].bytes == len(body.encode('utf-8')) > len(body)
+
+def per_token_budget(budgets):
+    '''An endpoint where each token has ``budgets[token]`` requests left.'''
+    def endpoint(headers):
+        token = headers['Authorization'].split()[1]
+        budgets[token] -= 1
+        limits = {
+            'x-ratelimit-remaining': str(max(0, budgets[token])),
+            'x-ratelimit-reset': str(int(time.time()) + 3600),
+        }
+        if budgets[token] < 0:
+            return FakeResponse(403, 'API rate limit exceeded', limits)
+        return FakeResponse(200, '[]', limits)
+    return endpoint
+
+@pytest.mark.asyncio
+async def test_token_pool_uses_the_token_with_most_headroom():
+    url = 'https://api.github.com/repos/ansible/ansible/pulls'
+    search = 'https://api.github.com/search/issues?q=a'
+    budgets = {'a': 100, 'b': 3}
+    session = FakeSession({
+        url: per_token_budget(budgets),
+        search: per_token_budget({'a': 0, 'b': 10}),
+    })
+    pool = TokenPool(['a', 'b'])
+    client = GitHubAPICall(pool, session, scheduler=RequestScheduler(reserve=0))
+
+    for _ in range(10):
+        await client.get(url)
+    # Neither was known at first, then 'a' had more left.
+    assert budgets == {'a': 91, 'b': 2}
+    assert pool.limits['a']['core'].remaining == 91
+
+    # Search is budgeted on its own: 'a' has none left, and the request is
+    # sent again with 'b' right away rather than waiting for the reset.
+    assert await client.get(search) == []
+    tokens = [h['Authorization'] for e, h in session.requests if e == search]
+    assert tokens == ['token a', 'token b']
+    assert pool.limits['a']['search'].remaining == 0
+    assert pool.limits['a']['core'].remaining == 91
+
+@pytest.mark.asyncio
+async def test_get_does_not_retry_forbidden():
+    url = 'https://api.github.com/repos/ansible/secret/pulls'
+    session = FakeSession({url: lambda h: FakeResponse(403, 'Forbidden')})
+
+    client = GitHubAPICall('token', session)
+    with pytest.raises(Exception, match='got status 403'):
+        await client.get(url)
+    assert len(session.requests) == 1
+
+def test_scheduler_paces_low_budget(monkeypatch):
+    monkeypatch.setattr(time, 'time', lambda: 1000)
+    scheduler = RequestScheduler(reserve=0.5)
+    url = 'https://api.github.com/search/issues'
+
+    scheduler.update(url, {
+        'x-ratelimit-limit': '30',
+        'x-ratelimit-remaining': '20',
+        'x-ratelimit-reset': '1100',
+        'x-ratelimit-resource': 'search',
+    })
+    assert scheduler.delay_for(url) == 0
+
+    # Below the reserve, requests are spread out one after another.
+    scheduler.update(url, {
+        'x-ratelimit-remaining': '10',
+        'x-ratelimit-reset': '1100',
+        'x-ratelimit-resource': 'search',
+    })
+    assert [scheduler.delay_for(url) for _ in range(3)] == [0, 10, 20]
+    assert scheduler.delay_for('https://api.github.com/repos/a/b') == 0
+
+    scheduler.update(url, {
+        'x-ratelimit-remaining': '0',
+        'x-ratelimit-reset': '1100',
+        'x-ratelimit-resource': 'search',
+    })
+    assert scheduler.delay_for(url) == 101
+
+@pytest.mark.asyncio
+async def test_paced_requests_leave_slots_free():
+    search = 'https://api.github.com/search/issues'
+    core = 'https://api.github.com/repos/a/b'
+    scheduler = RequestScheduler(max_concurrency=1)
+    scheduler.update(search, {
+        'x-ratelimit-remaining': '0',
+        'x-ratelimit-reset': str(int(time.time()) + 3600),
+        'x-ratelimit-resource': 'search',
+    })
+
+    async def send(endpoint):
+        async with scheduler.slot(endpoint):
+            return endpoint
+
+    waiting = asyncio.ensure_future(send(search))
+    await asyncio.sleep(0)
+    # The search waiting for its reset doesn't hold the only slot.
+    assert await asyncio.wait_for(send(core), timeout=1) == core
+    waiting.cancel()
+
+def paginated(base, pages, with_last=True):
+    '''Serve ``pages`` (a list of lists) from ``base`` at &page=N.'''
+    responses = {}
+    for number, page in enumerate(pages, 1):
+        links = []
+        if number < len(pages):
+            links.append('<{0}&page={1}>; rel="next"'.format(base, number + 1))
+            if with_last:
+                links.append(
+                    '<{0}&page={1}>; rel="last"'.format(base, len(pages)))
+        url = base if number == 1 else '{0}&page={1}'.format(base, number)
+        response = FakeResponse(
+            200,
+            json.dumps({'items': page}),
+            {'link': ', '.join(links)})
+        responses[url] = lambda headers, response=response: response
+    return responses
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('with_last', [True, False])
+async def test_get_all_pages(with_last):
+    pulls = 'https://api.github.com/repos/ansible/ansible/pulls?per_page=2'
+    issues = 'https://api.github.com/repos/ansible/ansible/issues?per_page=2'
+    responses = paginated(pulls, [[1, 2], [3, 4], [5]], with_last)
+    responses.update(paginated(issues, [['a', 'b'], ['c']], with_last))
+    session = FakeSession(responses)
+
+    # Two paginated calls on one client mustn't get each other's pages.
+    client = GitHubAPICall('token', session)
+    assert await asyncio.gather(
+        client.get_all_pages(pulls, key='items'),
+        client.get_all_pages(issues, key='items')) == [
+            [1, 2, 3, 4, 5],
+            ['a', 'b', 'c'],
+        ]
+    assert len(session.requests) == 5
+
+@pytest.mark.asyncio
+async def test_iter_pages_prefetches_a_window():
+    pulls = 'https://api.github.com/repos/ansible/ansible/pulls?per_page=1'
+    session = FakeSession(paginated(pulls, [[n] for n in range(1, 11)]))
+    client = GitHubAPICall('token', session)
+
+    pages = client.iter_pages(pulls, key='items', prefetch=2)
+    assert await pages.__anext__() == 1
+    assert await pages.__anext__() == 2
+    # The first page, the one we're on and the two after it.
+    await asyncio.sleep(0)
+    assert len(session.requests) == 4
+
+    # Stopping early doesn't fetch (or leave behind) the rest.
+    await pages.aclose()
+    await asyncio.sleep(0)
+    assert len(session.requests) == 4
@@ -0,0 +1,50 @@
+from releasible.model.pullrequest import *
+
+def make_pr(**fields):
+    pr = {
+        'number': 1,
+        'comments': 2,
+        'review_comments': 0,
+        'additions': 20,
+        'deletions': 10,
+        'changed_files': 3,
+        'commits': 1,
+        'labels': [],
+    }
+    pr.update(fields)
+    return pr
+
+def test_risk_profile():
+    pr = PullRequest(
+        make_pr(),
+        [
+            FileStat('lib/ansible/modules/ping.py', 20, 10),
+            FileStat('test/lib/ansible_test/foo.py', 0, 0),
+            FileStat('changelogs/fragments/ping.yml', 2, 0),
+        ])
+
+    assert pr.risk_profile == RiskProfile(
+        comments=4,
+        review_comments=4,
+        lines_changed=5,
+        files_changed=3,
+        commits=1,
+        high_weighted=5)
+    assert pr.risk == 22 / 60
+    assert not pr.is_missing_changelog
+
+def test_risk_profile_is_cached_until_data_changes():
+    pr = PullRequest(make_pr(), [])
+    profile = pr.risk_profile
+    assert pr.risk_profile is profile
+
+    pr.files = [FileStat('lib/ansible/cli/doc.py', 30, 0)]
+    assert pr.risk_profile is not profile
+    assert pr.risk_profile.high_weighted == 5
+    assert pr.is_missing_changelog
+
+    profile = pr.risk_profile
+    pr.pr['comments'] = 9
+    assert pr.risk_profile is profile
+    pr.invalidate_risk()
+    assert pr.risk_profile.comments == 10
@@ -1,6 +1,7 @@
 import arrow
 import packaging.version
 from releasible.pypi import *
+from test.fakes import FakeResponse, FakeSession
 
 import pytest
 
@@ -35,3 +36,110 @@ def test_guess_next_version(release_ga, release_rc):
 
     assert release_rc.guess_next_date() == \
         arrow.get('2021-02-15T02:53:19.138189+00:00')
+
+def pypi_json(*releases, yanked=()):
+    return {
+        'releases': {
+            release: [{
+                'yanked': release in yanked,
+                'upload_time_iso_8601': '2021-02-18T22:53:20.617927+00:00',
+            }]
+            for release in releases
+        },
+    }
+
+def test_latest():
+    pypi = PyPI('ansible', pypi_json(
+        '2.1.0', '2.9.18', '2.9.19rc1', '2.10.0b1', '2.10.6', '2.10.7',
+        '2.11.0b1', 'not-a-version',
+        yanked=('2.10.7',)))
+
+    assert pypi.latest('2.10') == Release(
+        'ansible',
+        packaging.version.Version('2.10.6'),
+        True,
+        Stage.GENERAL_AVAILABILITY,
+        arrow.get('2021-02-18T22:53:20.617927+00:00'))
+    assert pypi.latest('2.9').version == packaging.version.Version('2.9.19rc1')
+    assert pypi.latest('2.9').stage == Stage.RELEASE_CANDIDATE
+    # Unlike matching release strings by prefix, 2.1 doesn't mean 2.10.
+    assert pypi.latest('2.1').version == packaging.version.Version('2.1.0')
+    assert pypi.latest('2.11').version == packaging.version.Version('2.11.0b1')
+    assert pypi.latest('2.12') is None
+    assert pypi.latest('1') is None
+
+def test_newest_prerelease():
+    pypi = PyPI('jinja2', pypi_json('1.0', '1.1a1'))
+    assert pypi.newest().version == packaging.version.Version('1.0')
+    assert pypi.newest(prereleases=True).stage == Stage.ALPHA
+    assert Stage.from_version('1.1a1') == Stage.ALPHA
+    assert Stage.from_version('1.1b1') == Stage.BETA
+
+def etag_endpoint(body):
+    def endpoint(headers):
+        if headers.get('If-None-Match') == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, body, {'etag': '"v1"'})
+    return endpoint
+
+@pytest.mark.asyncio
+async def test_client_fetches_each_package_once(tmp_path):
+    import asyncio
+    import json
+    from releasible.cache import open_cache
+    from releasible.trace import Tracer
+
+    cache = open_cache(str(tmp_path / 'pypi.sqlite'))
+    session = FakeSession({
+        'https://pypi.org/pypi/ansible/json':
+            etag_endpoint(json.dumps(pypi_json('2.10.6'))),
+    })
+    client = PyPIClient(session, cache)
+    packages = await asyncio.gather(
+        client.package('ansible'),
+        client.package('ansible'))
+    assert packages[0] is packages[1]
+    assert packages[0].latest('2.10').version == \
+        packaging.version.Version('2.10.6')
+    assert session.requests == [('https://pypi.org/pypi/ansible/json', {})]
+
+    # A new client revalidates what the last one fetched.
+    tracer = Tracer()
+    client = PyPIClient(session, cache, tracer=tracer)
+    assert (await client.package('ansible')).latest('2.10') is not None
+    assert session.requests[-1][1] == {'If-None-Match': '"v1"'}
+    assert [(r.endpoint, r.status, r.cache) for r in tracer.requests] == \
+        [('https://pypi.org/pypi/ansible/json', 304, 'hit')]
+
+@pytest.mark.asyncio
+async def test_client_bounds_bulk_fetches():
+    import asyncio
+    import json
+
+    in_flight = []
+    most = 0
+
+    class SlowResponse(FakeResponse):
+        async def __aenter__(self):
+            nonlocal most
+            in_flight.append(self)
+            most = max(most, len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(self)
+            return self
+
+    body = json.dumps(pypi_json('1.0', '1.1', yanked=('1.1',)))
+    pkgs = ['pkg{0}'.format(n) for n in range(10)]
+    session = FakeSession({
+        'https://pypi.org/pypi/{0}/json'.format(pkg):
+            lambda headers: SlowResponse(200, body)
+        for pkg in pkgs
+    })
+    client = PyPIClient(session, max_concurrency=3)
+    packages = await client.packages(pkgs + pkgs[:2])
+
+    assert sorted(packages) == pkgs
+    assert len(session.requests) == 10
+    assert most == 3
+    assert packages['pkg0'].newest().version == packaging.version.Version('1.0')
+    assert packages['pkg0'].yanked == [packaging.version.Version('1.1')]
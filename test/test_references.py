@@ -0,0 +1,28 @@
+from releasible.references import *
+
+def test_extract_references_priority():
+    body = '\n'.join([
+        'Fixes #1, see foo/bar#2 and https://github.com/foo/bar/pull/3 #4',
+        'https://github.com/ansible/ansible/commit/abc123 and #5',
+        'cherry-picked from commit def456',
+        '#1 again, and FOO/Bar#2',
+    ])
+    assert extract_references('Something (backport of #9)', body) == (
+        TicketRef(9),
+        # Bare numbers first, then PR links, then user/repo#n.
+        TicketRef(1),
+        TicketRef(4),
+        PullRef('foo', 'bar', 3),
+        PullRef('foo', 'bar', 2),
+        # Only the commit counts on a line with one.
+        CommitRef('abc123'),
+        CommitRef('def456'),
+    )
+
+def test_extract_references_is_memoized():
+    first = extract_references('Title', 'Fixes #1')
+    assert extract_references('Title', 'Fixes #1') is first
+    assert extract_references('Title', 'Fixes #2') == (TicketRef(2),)
+
+def test_extract_references_ignores_non_references():
+    assert extract_references('No (parens)', 'issue#1 and a#b\r\n') == ()
@@ -0,0 +1,68 @@
+import arrow
+import gzip
+import json
+import packaging.version
+import pytest
+from releasible.model.pullrequest import Backport, FileStat, PullRequest
+from releasible.pypi import Release, Stage
+from releasible.snapshot import *
+
+def make_backport(number, original=None):
+    pr = {
+        'number': number,
+        'url': 'https://api.github.com/repos/ansible/ansible/pulls/{0}'.format(
+            number),
+        'comments': 3,
+        'labels': [{'name': 'backport', 'color': 'fff'}],
+        'node_id': 'dropped',
+    }
+    return Backport(pr, [FileStat('lib/ansible/x.py', 10, 2)], original)
+
+def test_roundtrip(tmp_path):
+    original = PullRequest(
+        {'number': 1, 'comments': 9},
+        [FileStat('lib/ansible/y.py', 100, 0)])
+    release = Release(
+        'ansible-core',
+        packaging.version.Version('2.11.0rc1'),
+        True,
+        Stage.RELEASE_CANDIDATE,
+        arrow.get('2021-04-01T00:00:00+00:00'))
+    contexts = {
+        'backports': {
+            'backports': {'2.11': [make_backport(2, original), make_backport(3)]},
+            'max_risk': 12,
+        },
+        'packages': {'releases': [(release, None)]},
+        'dependencies': {'dependencies': [{
+            'name': 'jinja2',
+            'latest': release,
+            'yanked': [packaging.version.Version('2.0')],
+        }]},
+    }
+
+    path = str(tmp_path / 'snapshot.json.gz')
+    dump(contexts, path)
+    loaded = load(path)
+
+    with_original, without = loaded['backports']['backports']['2.11']
+    assert isinstance(with_original, Backport)
+    assert with_original.original.pr == {'number': 1, 'comments': 9}
+    assert with_original.risk == contexts['backports']['backports']['2.11'][0].risk
+    assert without.original is None
+    # Only what we use is kept.
+    assert 'node_id' not in with_original.pr
+    assert with_original.pr['labels'] == [{'name': 'backport'}]
+
+    assert loaded['packages']['releases'] == [[release, None]]
+    assert loaded['packages']['releases'][0][0].date == release.date
+    assert loaded['packages']['releases'][0][0].stage is Stage.RELEASE_CANDIDATE
+    assert loaded['dependencies']['dependencies'][0]['yanked'] == [
+        packaging.version.Version('2.0')]
+
+def test_other_version(tmp_path):
+    path = str(tmp_path / 'snapshot.json.gz')
+    with gzip.open(path, 'wt') as f:
+        json.dump({'version': SNAPSHOT_VERSION + 1, 'contexts': {}}, f)
+    with pytest.raises(SnapshotError, match='Fetch again'):
+        load(path)